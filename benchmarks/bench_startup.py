@@ -0,0 +1,49 @@
+"""
+Startup time benchmark.
+
+Every stage runs in a fresh interpreter, so module caches of a previous run don't hide import costs.
+Nothing is requested over the network, the Google Drive service is built with anonymous credentials.
+
+Usage:
+python benchmarks/bench_startup.py --runs 10
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = {
+    'interpreter': "pass",
+    'import gloader': "import mko_gloader.gloader",
+    'import GoogleDriveHelper': "from mko_gloader.utils import GoogleDriveHelper",
+    'build service': (
+        "from google.auth.credentials import AnonymousCredentials\n"
+        "from mko_gloader.utils import TransportPool\n"
+        "TransportPool(AnonymousCredentials()).service()"
+    ),
+}
+
+
+def run_stage(code):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, check=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = ArgumentParser(description="Measure the startup time of gloader")
+    parser.add_argument('--runs', type=int, default=5, help='Runs of every stage')
+    runs = parser.parse_args().runs
+
+    print(f"{'stage':<28}{'min, ms':>10}{'median, ms':>12}")
+    for name, code in STAGES.items():
+        times = [run_stage(code) for _ in range(runs)]
+        print(f"{name:<28}{min(times) * 1000:>10.0f}{statistics.median(times) * 1000:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,12 @@ from mko_gloader.utils.functions import (
 from mko_gloader.loader import GLoader
 
 
-def upload(gd_instance, parser, *args):
+def upload(parser, *args):
     try:
         local_source, google_destination, google_parent, *_ = *args, None, None
         if not os.path.exists(local_source):
             raise parser.error(f"Local path:{local_source} is not a valid path")
+        gd_instance = utils.GoogleDriveHelper()
         gd_path_arr = pathstr_to_list(google_destination)
         gd_destination_id = gd_instance.check_google_drive_path(gd_path_arr, google_parent, True)
         gloader_instance = GLoader(local_source, gd_path_arr[-1], gd_destination_id)
@@ -23,6 +24,20 @@ def upload(gd_instance, parser, *args):
         print(err)
 
 
+def watch(parser, *args):
+    try:
+        local_source, google_destination, google_parent, *_ = *args, None, None
+        if not os.path.isdir(local_source):
+            raise parser.error(f"Local path:{local_source} is not a valid folder")
+        gd_instance = utils.GoogleDriveHelper()
+        gd_path_arr = pathstr_to_list(google_destination)
+        gd_destination_id = gd_instance.check_google_drive_path(gd_path_arr, google_parent, True)
+        gloader_instance = GLoader(local_source, gd_path_arr[-1], gd_destination_id)
+        gloader_instance.watch()
+    except Exception as err:
+        print(err)
+
+
 def list_files(gd_instance, *args):
     gdrive_tree = utils.Tree()
     gdrive_tree.add(['My Drive'], 'root')
@@ -69,6 +84,10 @@ def main(list_of_args: list = None):
                                      'usage1: -up /home/user/test/file.1 /docs/test/'
                                      'usage2: -up /home/user/test/file.1 /docs/test/ {parent_id}'
                                 )
+        arg_parser.add_argument('-w', '--watch', nargs='+', type=str,
+                                help='Keep pushing changes from LOCAL_PATH to GOOGLE_DRIVE_PATH, '
+                                     'usage: -w /home/user/test /docs/test/ [parent_id]'
+                                )
         arg_parser.add_argument('-a', '--access', nargs=3, type=str,
                                 help='Grant access to file or folder by id {e-mail} {role} {id}  ')
         arg_parser.add_argument('-lp', '--list-permissions', nargs=1, type=str,
@@ -91,6 +110,16 @@ def main(list_of_args: list = None):
                                 help='Set folder to keep ini file with settings')
         arg_parser.add_argument('--drop-settings', action='store_true',
                                 help='Drop settings to defaults')
+        arg_parser.add_argument('--chunk-size', type=float,
+                                help='Upload and download chunk size in MB')
+        arg_parser.add_argument('--adaptive-chunks', action='store_true', default=None,
+                                help='Grow chunk size while throughput improves and shrink it after errors')
+        arg_parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                                help='Skip paths matching a gitignore-style pattern, can be repeated, '
+                                     'replaces the patterns from config.ini')
+        arg_parser.add_argument('--include', action='append', metavar='PATTERN',
+                                help='Select excluded paths matching a gitignore-style pattern, can be repeated, '
+                                     'replaces the patterns from config.ini')
         if args is not None:
             return arg_parser.parse_args(args)
         return arg_parser.parse_args()
@@ -106,31 +135,46 @@ def main(list_of_args: list = None):
         utils.ConfigHelper(params['settings_path'][0])
         return
     elif params['drop_settings'] is True:
-        conf_help = utils.ConfigHelper()
+        conf_help = utils.ConfigHelper.shared()
         conf_help.restore_defaults()
 
-    gd_instance = utils.GoogleDriveHelper()
-
-    if params['upload'] is not None:
-        upload(gd_instance, arg_parser, *params['upload'])
-    elif params['list_files'] is not None:
-        list_files(gd_instance, params['list_files'])
-    elif params['remove'] is not None:
-        gd_instance.hard_delete_file(params['remove'][0])
-    elif params['clear'] is not None:
-        gd_instance.cleanup_folder_by_id(params['clear'])
-    elif params['list_trash'] is True:
-        gd_instance.list_trash()
-    elif params['clear_trash'] is True:
-        gd_instance.clear_trash()
-    elif params['access'] is not None:
-        gd_instance.grant_permissions(*params['access'][::-1])
-    elif params['list_permissions'] is not None:
-        gd_instance.list_permissions(*params['list_permissions'])
-    elif params['drop_permissions'] is not None:
-        gd_instance.drop_permission(*params['drop_permissions'])
-    elif params['test'] is not None:
-        list_files(gd_instance, *params['test'])
+    utils.ConfigHelper.set_overrides(
+        chunk_size_mb=params.pop('chunk_size'),
+        adaptive_chunks=params.pop('adaptive_chunks'),
+        exclude_patterns=params.pop('exclude'),
+        include_patterns=params.pop('include')
+    )
+
+    try:
+        # The Google Drive helper is created once the arguments are checked,
+        # so a wrong local path is reported without loading the credentials
+        if params['upload'] is not None:
+            upload(arg_parser, *params['upload'])
+        elif params['watch'] is not None:
+            watch(arg_parser, *params['watch'])
+        else:
+            gd_instance = utils.GoogleDriveHelper()
+            if params['list_files'] is not None:
+                list_files(gd_instance, params['list_files'])
+            elif params['remove'] is not None:
+                gd_instance.hard_delete_file(params['remove'][0])
+            elif params['clear'] is not None:
+                gd_instance.cleanup_folder_by_id(params['clear'])
+            elif params['list_trash'] is True:
+                gd_instance.list_trash()
+            elif params['clear_trash'] is True:
+                gd_instance.clear_trash()
+            elif params['access'] is not None:
+                gd_instance.grant_permissions(*params['access'][::-1])
+            elif params['list_permissions'] is not None:
+                gd_instance.list_permissions(*params['list_permissions'])
+            elif params['drop_permissions'] is not None:
+                gd_instance.drop_permission(*params['drop_permissions'])
+            elif params['test'] is not None:
+                list_files(gd_instance, *params['test'])
+    finally:
+        # Written even if the command failed, failed runs are worth graphing too
+        utils.Metrics.shared().export(utils.ConfigHelper.shared())
 
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
 import os
+import stat
 import mko_gloader.utils as utils
+from mko_gloader.utils.sync_helper import PUSH, PULL, CONFLICT
+from mko_gloader.utils.tree import Difference
 import traceback
 
+# Seconds after which watched changes are pushed even if the folder keeps changing
+WATCH_MAX_DELAY = 30
+
 
 class GLoader:
     """
@@ -29,6 +35,12 @@ class GLoader:
             self.logger.info("Program Started")
             self.gdrive = utils.GoogleDriveHelper(local_source, google_destination, google_parent)
             self.filesystem = utils.FilesystemHelper(local_source) if local_source else None
+            self.state = utils.StateHelper()
+            self.transfer = utils.TransferHelper(self.gdrive)
+            self.sync_helper = utils.SyncHelper(self.state)
+            # Trees and change sets shared by every operation of this instance
+            self.planner = utils.SyncPlanner(self.fetch_trees)
+            self.metrics = utils.Metrics.shared()
         except Exception as e:
             # Log the error using the logger
             self.logger.error(f"Error occurred in GSpace initialization: {e}")
@@ -37,22 +49,56 @@ class GLoader:
             # Raise the exception again to notify the caller about the error
             raise e
 
+    def fetch_remote_tree(self):
+        """
+        Build the Google Drive tree of the destination folder.
+
+        When the Changes API is enabled, the tree is restored from the snapshot saved by
+        the previous run and only the changes made since then are requested.
+        """
+        gdrive_tree = utils.Tree()
+        gdrive_tree.add([self.gdrive.destination_folder_name], self.gdrive.parent_folder_id)
+        if not self.gdrive.configuration.use_changes_api:
+            self.gdrive.generate_tree_from_google_drive(gdrive_tree)
+            return gdrive_tree
+
+        state_key = f"{self.gdrive.parent_folder_id}/{self.gdrive.destination_folder_name}"
+        snapshot = self.state.load('remote_tree', state_key)
+        snapshot = self.gdrive.generate_tree_from_snapshot(gdrive_tree, snapshot)
+        self.state.save('remote_tree', state_key, snapshot)
+        return gdrive_tree
+
+    def fetch_trees(self):
+        """
+        Build the Google Drive and the local filesystem trees.
+
+        Returns:
+        The Google Drive tree, the local filesystem tree and the hash function to compare them with.
+        """
+        with self.metrics.phase('remote_listing'):
+            gdrive_tree = self.fetch_remote_tree()
+        local_fs_tree = utils.Tree()
+        with self.metrics.phase('local_scan'):
+            self.filesystem.generate_tree_from_filesystem(local_fs_tree)
+        # In 'md5' mode files of the same size are compared by checksum as well
+        hash_func = self.filesystem.get_file_md5 if self.gdrive.configuration.compare_mode == 'md5' else None
+        return gdrive_tree, local_fs_tree, hash_func
+
     def fetch(self, update_type="Local Filesystem"):
         """
         Fetch changes from Google Drive and local filesystem, and print the differences.
 
+        Both sides are listed only once per instance, later calls reuse the planner state.
+
         Parameters:
         - update_type: Type of update, either "Local Filesystem" or "Google Drive".
         """
         try:
-            gdrive_tree, local_fs_tree = utils.Tree(), utils.Tree()
-            gdrive_tree.add([self.gdrive.destination_folder_name], self.gdrive.parent_folder_id)
-            self.gdrive.generate_tree_from_google_drive(gdrive_tree)
-            self.filesystem.generate_tree_from_filesystem(local_fs_tree)
+            gdrive_tree, local_fs_tree, _ = self.planner.trees()
             # gdrive_tree.traverse_and_print()
             # local_fs_tree.traverse_and_print()
-            changes_in_local = local_fs_tree.find_difference_path(gdrive_tree)
-            changes_in_server = gdrive_tree.find_difference_path(local_fs_tree)
+            changes_in_local = self.planner.changes('local')
+            changes_in_server = self.planner.changes('server')
             print("============================================")
 
             print("Following changes will take place in " + update_type)
@@ -89,6 +135,28 @@ class GLoader:
             # Raise the exception again to notify the caller about the error
             raise e
 
+    @staticmethod
+    def confirm():
+        """
+        Ask the user whether to go on with changes to the local filesystem.
+
+        Returns:
+        True if the user answered 'yes'.
+        """
+        confirmation = ""
+
+        while confirmation not in ["yes", "no"]:
+            confirmation = input("Are you sure you want to continue? [yes, no]\n >>> ")
+            if confirmation not in ["yes", "no"]:
+                print("Usage: 'yes' or 'no'")
+
+        if confirmation == "no":
+            print("============================================")
+            print("Canceled by user!\nExiting ...")
+            print("============================================")
+            return False
+        return True
+
     def pull(self):
         """
         Pull changes from Google Drive to the local filesystem.
@@ -102,45 +170,44 @@ class GLoader:
                 print("No changes to pull!\nExiting ...")
                 return print("============================================")
 
-            confirmation = ""
+            if not self.confirm():
+                return
 
-            while confirmation not in ["yes", "no"]:
-                confirmation = input("Are you sure you want to continue? [yes, no]\n >>> ")
-                if confirmation not in ["yes", "no"]:
-                    print("Usage: 'yes' or 'no'")
+            # Taken before any change is completed and dropped from the change sets
+            additions, modifications, deletions = (list(changes_in_server[kind])
+                                                   for kind in ("Additions", "Modifications", "Deletions"))
 
-            if confirmation == "no":
+            # Files replaced by folders or back are removed before the new ones are downloaded
+            if deletions:
+                print("============================================")
+                print("Starting removing files in local Filesystem:")
+                for to_delete in deletions:
+                    self.filesystem.soft_delete_from_filesystem(to_delete[0])
+                self.planner.complete(PULL, [change[0] for change in deletions])
+
+                print("Finished removing files from local Filesystem!")
                 print("============================================")
-                print("Canceled by user!\nExiting ...")
-                return print("============================================")
 
-            if len(changes_in_server["Additions"]):
+            if additions:
                 print("============================================")
                 print("Starting pulling changes from Google Drive:")
-                for to_download in changes_in_server["Additions"]:
-                    self.gdrive.download_helper(to_download[0], to_download[1], to_download[2])
+                jobs = self.transfer.plan_downloads(gdrive_tree, additions)
+                self.transfer.download(jobs)
+                self.planner.complete(PULL, [change[0] for change in additions])
 
-            if len(changes_in_server["Modifications"]):
+            if modifications:
                 print("============================================")
                 print("Starting modifications in local Filesystem:")
                 print("============================================")
 
-                for to_modify in changes_in_server["Modifications"]:
-                    self.filesystem.hard_delete_from_filesystem(to_modify[0])
-                    self.gdrive.download_helper(to_modify[0], to_modify[1], to_modify[2])
+                # Downloaded files replace the local ones only once complete
+                jobs = self.transfer.plan_downloads(gdrive_tree, modifications)
+                self.transfer.download(jobs)
+                self.planner.complete(PULL, [change[0] for change in modifications])
 
                 print("Finished modification changes from Google Drive!")
                 print("============================================")
 
-            if len(changes_in_server["Deletions"]):
-                print("============================================")
-                print("Starting removing files in local Filesystem:")
-                for to_delete in changes_in_server["Deletions"]:
-                    self.filesystem.soft_delete_from_filesystem(to_delete[0])
-
-                print("Finished removing files from local Filesystem!")
-                print("============================================")
-
             print("SUCCESS: Pulled Google Drive!")
             self.logger.info("Pulled from google drive")
 
@@ -155,58 +222,65 @@ class GLoader:
     def push(self):
         """
         Push changes from the local filesystem to Google Drive.
+
+        Uploads start while the trees are still being compared, unless the changes were already
+        fetched, deletions are done once the comparison and the uploads are over.
         """
         try:
-            changes_in_local, changes_in_server, gdrive_tree, local_fs_tree = self.fetch(update_type="Google Drive")
+            gdrive_tree = self.planner.trees()[0]
+            counts = dict.fromkeys(("Additions", "Modifications", "Deletions"), 0)
+            deferred, deletions, uploaded, replaced = [], [], [], []
+
+            def changes():
+                deleted_paths = set()
+                for change in self.planner.iter_changes('local'):
+                    counts[change.kind] += 1
+                    print({"Additions": "+", "Modifications": "*", "Deletions": "-"}[change.kind], change.path)
+                    if change.kind == "Deletions":
+                        deletions.append(change)
+                        deleted_paths.add(change.path)
+                    elif change.path in deleted_paths:
+                        # A file replaced by a folder or back, uploaded once the old node is deleted
+                        replaced.append(change.path)
+                    else:
+                        uploaded.append(change.path)
+                        yield change
 
-            if (not changes_in_local["Additions"] and not changes_in_local["Deletions"]
-                    and not changes_in_local["Modifications"]):
-                print("============================================")
+            print("============================================")
+            print("Following changes will take place in Google Drive")
+            self.transfer.upload(gdrive_tree, self.transfer.stream_uploads(gdrive_tree, changes(), deferred))
+            print("============================================")
+
+            if not any(counts.values()):
                 print("No changes to push!\nExiting ...")
                 return print("============================================")
 
-            confirmation = "yes"  # change to "" to ask user
-
-            while confirmation not in ["yes", "no"]:
-                confirmation = input("Are you sure you want to continue? [yes, no]\n >>> ")
-                if confirmation not in ["yes", "no"]:
-                    print("Usage: 'yes' or 'no'")
-
-            if confirmation == "no":
-                print("============================================")
-                print("Canceled by user!\nExiting ...")
-                return print("============================================")
+            print(", ".join(f"{kind} ({count})" for kind, count in counts.items()))
 
-            if len(changes_in_local["Additions"]):
+            if deferred:
                 print("============================================")
-                print("Starting pushing changes to Google Drive:")
-                for to_upload in changes_in_local["Additions"]:
-                    self.gdrive.upload_helper(gdrive_tree, to_upload)
+                print("Starting pushing new folders to Google Drive:")
+                jobs = self.transfer.plan_uploads(gdrive_tree, deferred)
+                self.transfer.upload(gdrive_tree, jobs)
 
                 print("Finished pushing changes to Google Drive!")
                 print("============================================")
+            self.planner.complete(PUSH, uploaded)
 
-            if len(changes_in_server["Modifications"]):
-                print("============================================")
-                print("Starting modifications in Google Drive:")
-                print("============================================")
-
-                for to_modify in changes_in_server["Modifications"]:
-                    self.gdrive.delete_file(to_modify[1], gdrive_tree=gdrive_tree)
-                    self.gdrive.upload_helper(gdrive_tree, to_modify)
-
-                print("Finished modifications in Google Drive!")
-                print("============================================")
-
-            if len(changes_in_local["Deletions"]):
+            if deletions:
                 print("============================================")
                 print("Starting removing files from Google Drive:")
-                for to_delete in changes_in_local["Deletions"]:
-                    self.gdrive.delete_file(to_delete[1], gdrive_tree=gdrive_tree)
+                for to_delete in deletions:
+                    self.gdrive.delete_file(to_delete.drive_id, gdrive_tree=gdrive_tree)
+                self.planner.complete(PUSH, [change.path for change in deletions])
 
                 print("Finished removing files from Google Drive!")
                 print("============================================")
 
+            if replaced:
+                self.transfer.upload(gdrive_tree, self.transfer.plan_uploads(gdrive_tree, replaced))
+                self.planner.complete(PUSH, replaced)
+
             print("SUCCESS: Pushing to Google Drive!")
             self.logger.info("Pushed to Google Drive")
 
@@ -218,14 +292,172 @@ class GLoader:
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def sync(self):
+    def push_paths(self, paths):
         """
-        Synchronize changes between the local filesystem and Google Drive.
+        Push the current state of some local paths to Google Drive.
+
+        The paths are compared with the Google Drive tree kept by the planner, nothing is listed.
+
+        Parameters:
+        - paths: Paths relative to the local source folder, e.g. '/docs/file.txt'.
+        """
+        gdrive_tree, _, hash_func = self.planner.trees()
+        changes, deletions, covered = [], [], ()
+        for path in sorted(paths):
+            if path.startswith(covered):
+                # Inside a folder added or deleted as a whole
+                continue
+            names = path.strip('/').split('/')
+            node, nodes_traversed = gdrive_tree.get_node(names)
+            remote = node if nodes_traversed == len(names) else None
+            try:
+                local_stat = os.stat(self.local_source + path)
+            except FileNotFoundError:
+                local_stat = None
+            is_dir = local_stat is not None and stat.S_ISDIR(local_stat.st_mode)
+
+            if remote is not None and (local_stat is None or bool(remote.isDir) != is_dir):
+                deletions.append(Difference("Deletions", path, remote.id, remote.isDir))
+                if remote.isDir:
+                    covered += (path + '/',)
+                remote = None
+            if local_stat is None:
+                continue
+            if remote is None:
+                changes.append(Difference("Additions", path, None, is_dir))
+                if is_dir:
+                    covered += (path + '/',)
+            elif not is_dir and (int(remote.fileSize or 0) != local_stat.st_size or hash_func is not None and (
+                    # Without a remote checksum only the size is compared, or the file is sent on every event
+                    remote.md5 is not None and remote.md5 != hash_func(path))):
+                changes.append(Difference("Modifications", path, remote.id, False))
+
+        for change in changes + deletions:
+            print({"Additions": "+", "Modifications": "*", "Deletions": "-"}[change.kind], change.path)
+        for to_delete in deletions:
+            self.gdrive.delete_file(to_delete.drive_id, gdrive_tree=gdrive_tree)
+        deferred = []
+        self.transfer.upload(gdrive_tree, self.transfer.stream_uploads(gdrive_tree, changes, deferred))
+        if deferred:
+            self.transfer.upload(gdrive_tree, self.transfer.plan_uploads(gdrive_tree, deferred))
+        # The local tree and the change sets no longer match the folder
+        self.planner.reset(keep_trees=True)
+
+    def watch(self):
         """
+        Keep pushing local changes to Google Drive until interrupted.
+
+        Changes are reported by inotify, bursts are pushed together once the folder stays quiet
+        for the configured debounce period. Only the touched paths are compared with the
+        Google Drive tree kept in memory, both sides are listed again only if events were lost.
+        """
+        watcher = None
         try:
-            self.pull()
+            # Started before the first push, so nothing changed meanwhile is missed
+            watcher = utils.InotifyWatcher(self.local_source, self.filesystem.path_filter)
             self.push()
+            self.metrics.export(self.gdrive.configuration)
+            debounce = self.gdrive.configuration.watch_debounce or 2
+            rescan = False
+            print(f"Watching {self.local_source} for changes, press Ctrl+C to stop")
+            while True:
+                paths = watcher.wait_for_changes(debounce, WATCH_MAX_DELAY)
+                # Every pushed burst is a run of its own for the metrics readers
+                self.metrics.reset()
+                try:
+                    if paths is None or rescan:
+                        self.logger.info("Rescanning the watched folder")
+                        self.planner.reset()
+                        self.push()
+                    else:
+                        self.push_paths(paths)
+                    rescan = False
+                    self.metrics.export(self.gdrive.configuration)
+                except Exception as e:
+                    # Keep watching, the failed paths are picked up by a full push after the next change
+                    self.logger.error(f"Error occurred in watch: {e}")
+                    self.logger.error(traceback.format_exc())
+                    rescan = True
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in watch: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+        finally:
+            if watcher:
+                watcher.close()
+
+    def sync(self, assume_yes=False):
+        """
+        Synchronize changes between the local filesystem and Google Drive.
+
+        Both sides are listed once and compared with the state saved by the previous sync,
+        so changes are applied in the direction they were made. Conflicts are only reported.
+        Like pull, the user is asked before local files are overwritten or deleted.
+
+        Parameters:
+        - assume_yes: Boolean indicating whether to apply the changes without asking.
+        """
+        try:
+            gdrive_tree, local_fs_tree, hash_func = self.planner.trees()
+            base_key = f"{self.local_source}|{self.gdrive.parent_folder_id}/{self.gdrive.destination_folder_name}"
+            base_tree = self.sync_helper.load_base(base_key)
+            with self.metrics.phase('diff'):
+                changes = list(self.sync_helper.iter_changes(base_tree, local_fs_tree, gdrive_tree, hash_func))
+
+            grouped = {(direction, kind): [] for direction in (PUSH, PULL)
+                       for kind in ("Additions", "Modifications", "Deletions")}
+            conflicts = []
+            for change in changes:
+                if change.direction == CONFLICT:
+                    conflicts.append(change)
+                else:
+                    grouped[(change.direction, change.kind)].append(change)
+
+            print("============================================")
+            for (direction, kind), group in grouped.items():
+                if group:
+                    print(f"{direction} {kind} ({len(group)}):")
+                    for change in group:
+                        print({"Additions": "+", "Modifications": "*", "Deletions": "-"}[kind], change.path)
+            if conflicts:
+                print(f"Conflicts ({len(conflicts)}), left untouched:")
+                for change in conflicts:
+                    print("!", change.path)
+            print("============================================")
 
+            if (grouped[(PULL, "Modifications")] or grouped[(PULL, "Deletions")]) and not (
+                    assume_yes or self.confirm()):
+                return
+
+            # Google Drive
+            push_changes = grouped[(PUSH, "Additions")] + grouped[(PUSH, "Modifications")]
+            deferred = []
+            self.transfer.upload(gdrive_tree, self.transfer.stream_uploads(gdrive_tree, push_changes, deferred))
+            if deferred:
+                self.transfer.upload(gdrive_tree, self.transfer.plan_uploads(gdrive_tree, deferred))
+            for change in grouped[(PUSH, "Deletions")]:
+                self.gdrive.delete_file(change.drive_id, gdrive_tree=gdrive_tree)
+
+            # Local filesystem
+            pull_changes = grouped[(PULL, "Additions")] + grouped[(PULL, "Modifications")]
+            if pull_changes:
+                jobs = self.transfer.plan_downloads(
+                    gdrive_tree, [(change.path, change.drive_id, change.is_dir) for change in pull_changes])
+                self.transfer.download(jobs)
+                for change in pull_changes:
+                    self.sync_helper.copy_node(gdrive_tree, local_fs_tree, change.path)
+            for change in grouped[(PULL, "Deletions")]:
+                self.filesystem.soft_delete_from_filesystem(change.path)
+                local_fs_tree.remove(change.path.strip('/').split('/'))
+
+            self.sync_helper.save_base(base_key, local_fs_tree, gdrive_tree, conflicts, base_tree)
+            # The trees were updated along the way, the two-way change sets are outdated
+            self.planner.reset(keep_trees=True)
             self.logger.info("Sync from Google Drive and Local System Completed")
 
         except Exception as e:
@@ -1,7 +1,35 @@
-from .filesystem_helper import FilesystemHelper
-from .google_drive_helper import GoogleDriveHelper
-from .logger import Logger
-from .tree import Tree
-from .config_helper import ConfigHelper
+from importlib import import_module
 
+# Helpers are imported on first access, so commands that don't talk to Google Drive
+# don't pay for loading the Google client stack
+_EXPORTS = {
+    'FilesystemHelper': '.filesystem_helper',
+    'GoogleDriveHelper': '.google_drive_helper',
+    'Logger': '.logger',
+    'Tree': '.tree',
+    'ConfigHelper': '.config_helper',
+    'StateHelper': '.state_helper',
+    'ScanIndex': '.scan_index',
+    'TransferHelper': '.transfer_helper',
+    'SyncHelper': '.sync_helper',
+    'SyncPlanner': '.sync_planner',
+    'PathFilter': '.path_filter',
+    'InotifyWatcher': '.inotify_watcher',
+    'RequestHelper': '.request_helper',
+    'TransportPool': '.transport',
+    'Metrics': '.metrics',
+}
 
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
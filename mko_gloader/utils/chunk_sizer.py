@@ -0,0 +1,67 @@
+MB = 1024 * 1024
+# Resumable uploads require every chunk except the last one to be a multiple of 256 KB
+CHUNK_ALIGN = 256 * 1024
+MIN_CHUNK_SIZE = CHUNK_ALIGN
+# Downloads keep a whole chunk in memory and a failed chunk is sent again in full
+MAX_CHUNK_SIZE = 256 * MB
+# Relative throughput change that is considered an improvement
+GROWTH_THRESHOLD = 1.1
+
+
+class ChunkSizer:
+    """
+    Picks the chunk size for every request of a single upload or download.
+
+    With a fixed size the configured value is always used. In adaptive mode the chunk
+    is doubled while the throughput keeps improving and halved after every error.
+
+    Usage:
+    sizer = ChunkSizer(8 * MB, adaptive=True)
+    size = sizer.chunk_size
+    sizer.record(bytes_sent, seconds)
+    sizer.record_error()
+    """
+
+    def __init__(self, chunk_size, adaptive=False, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+        """
+        Initialize ChunkSizer.
+
+        Parameters:
+        - chunk_size: Initial chunk size in bytes.
+        - adaptive: Boolean enabling the adaptive mode.
+        - min_size: The smallest chunk used in adaptive mode.
+        - max_size: The largest chunk used in any mode.
+        """
+        self.adaptive = adaptive
+        self.min_size = min_size
+        self.max_size = self._align(max_size)
+        self.chunk_size = self._align(min(chunk_size, self.max_size))
+        self._last_throughput = None
+
+    @staticmethod
+    def _align(size):
+        return max(CHUNK_ALIGN, int(size) // CHUNK_ALIGN * CHUNK_ALIGN)
+
+    def record(self, size, elapsed):
+        """
+        Record a successful chunk and adjust the next chunk size.
+
+        Parameters:
+        - size: Number of bytes transferred.
+        - elapsed: Time taken by the request in seconds.
+        """
+        if not self.adaptive or size < self.chunk_size or elapsed <= 0:
+            # The last, shorter chunk says nothing about the link
+            return
+        throughput = size / elapsed
+        if self._last_throughput is None or throughput > self._last_throughput * GROWTH_THRESHOLD:
+            self.chunk_size = min(self.max_size, self.chunk_size * 2)
+        self._last_throughput = throughput
+
+    def record_error(self):
+        """
+        Record a failed chunk and shrink the next chunk size.
+        """
+        if self.adaptive:
+            self.chunk_size = max(self.min_size, self._align(self.chunk_size // 2))
+            self._last_throughput = None
@@ -22,6 +22,9 @@ CONFIG_DEFAULTS = {
         'logs_path': '',
         'keep_logs': True
     },
+    'Backup': {
+        'backup_path': ''
+    },
     'GoogleDriveAPI': {
         'cred_path': '',
         'use_token': False,
@@ -29,11 +32,48 @@ CONFIG_DEFAULTS = {
             'https://www.googleapis.com/auth/drive'
         ]
     },
+    'Performance': {
+        'list_workers': 8,
+        'scan_workers': 8,
+        'listing_mode': 'auto',
+        'use_changes_api': True,
+        'use_scan_index': True,
+        'compare_mode': 'size',
+        'upload_workers': 4,
+        'download_workers': 4,
+        'chunk_size_mb': 100,
+        'adaptive_chunks': False,
+        'max_chunk_size_mb': 256,
+        'multipart_threshold_mb': 5,
+        'watch_debounce': 2,
+        # Client-side limit of the requests sent by all workers, 0 disables it and the requests
+        # are only slowed down by the backoff after Google Drive returns a rate limit error
+        'requests_per_second': 0,
+        # Requests sent at once before requests_per_second applies, 0 means one second worth of requests
+        'request_burst': 0,
+        'max_retries': 5,
+        'max_backoff': 64,
+        'connection_pool_size': 16,
+        'http_timeout': 120
+    },
+    'Filters': {
+        'exclude': [],
+        'include': []
+    },
+    'Metrics': {
+        'json_path': '',
+        'prometheus_path': ''
+    },
 
 }
 
 
 class ConfigHelper:
+    # Settings set from the command line, they take precedence over config.ini
+    overrides = {}
+    # Configuration shared by all helpers, see shared()
+    _shared = None
+
     def __init__(self, config_folder: str | None = None):
 
         self.config_path = self.get_config(config_folder)
@@ -50,6 +90,38 @@ class ConfigHelper:
         # Logs Settings
         self.logs_folder_path = None
         self.keep_logs = None
+
+        # Backup Settings
+        self.backup_folder_path = None
+
+        # Performance Settings
+        self.list_workers = None
+        self.scan_workers = None
+        self.listing_mode = None
+        self.use_changes_api = None
+        self.use_scan_index = None
+        self.compare_mode = None
+        self.upload_workers = None
+        self.download_workers = None
+        self.chunk_size_mb = None
+        self.adaptive_chunks = None
+        self.max_chunk_size_mb = None
+        self.multipart_threshold_mb = None
+        self.watch_debounce = None
+        self.requests_per_second = None
+        self.request_burst = None
+        self.max_retries = None
+        self.max_backoff = None
+        self.connection_pool_size = None
+        self.http_timeout = None
+
+        # Filters Settings
+        self.exclude_patterns = None
+        self.include_patterns = None
+
+        # Metrics Settings
+        self.metrics_json_path = None
+        self.metrics_prometheus_path = None
         self.check_configuration()
 
     def get_config(self, config_folder: str | None = None):
@@ -129,6 +201,45 @@ class ConfigHelper:
                 self.keep_logs = self.config_reader.getboolean('Logs', 'keep_logs')
                 self.logs_folder_path = self.config_reader.get('Logs', 'logs_path')
 
+                # Backup Settings
+                self.backup_folder_path = self.config_reader.get('Backup', 'backup_path', fallback='')
+
+                # Performance Settings
+                self.list_workers = self.config_reader.getint('Performance', 'list_workers', fallback=8)
+                self.scan_workers = self.config_reader.getint('Performance', 'scan_workers', fallback=8)
+                self.listing_mode = self.config_reader.get('Performance', 'listing_mode', fallback='auto')
+                self.use_changes_api = self.config_reader.getboolean('Performance', 'use_changes_api', fallback=True)
+                self.use_scan_index = self.config_reader.getboolean('Performance', 'use_scan_index', fallback=True)
+                self.compare_mode = self.config_reader.get('Performance', 'compare_mode', fallback='size')
+                self.upload_workers = self.config_reader.getint('Performance', 'upload_workers', fallback=4)
+                self.download_workers = self.config_reader.getint('Performance', 'download_workers', fallback=4)
+                self.chunk_size_mb = self.config_reader.getfloat('Performance', 'chunk_size_mb', fallback=100)
+                self.adaptive_chunks = self.config_reader.getboolean('Performance', 'adaptive_chunks', fallback=False)
+                self.max_chunk_size_mb = self.config_reader.getfloat('Performance', 'max_chunk_size_mb', fallback=256)
+                self.multipart_threshold_mb = self.config_reader.getfloat(
+                    'Performance', 'multipart_threshold_mb', fallback=5)
+                self.watch_debounce = self.config_reader.getfloat('Performance', 'watch_debounce', fallback=2)
+                self.requests_per_second = self.config_reader.getfloat(
+                    'Performance', 'requests_per_second', fallback=0)
+                self.request_burst = self.config_reader.getint('Performance', 'request_burst', fallback=0)
+                self.max_retries = self.config_reader.getint('Performance', 'max_retries', fallback=5)
+                self.max_backoff = self.config_reader.getfloat('Performance', 'max_backoff', fallback=64)
+                self.connection_pool_size = self.config_reader.getint(
+                    'Performance', 'connection_pool_size', fallback=16)
+                self.http_timeout = self.config_reader.getfloat('Performance', 'http_timeout', fallback=120)
+
+                # Filters Settings
+                self.exclude_patterns = self.config_reader.getlist('Filters', 'exclude', fallback=[])
+                self.include_patterns = self.config_reader.getlist('Filters', 'include', fallback=[])
+
+                # Metrics Settings
+                self.metrics_json_path = self.config_reader.get('Metrics', 'json_path', fallback='')
+                self.metrics_prometheus_path = self.config_reader.get('Metrics', 'prometheus_path', fallback='')
+
+                # Command line settings
+                for k, v in self.overrides.items():
+                    setattr(self, k, v)
+
                 check_config = True
                 if not Path.is_file(Path(self.credentials_path)):
                     print(f"Credentials file is not found. Check path to credentials in {self.config}")
@@ -143,5 +254,34 @@ class ConfigHelper:
             print(f'Error: {err}, restoring default settings.')
         exit()
 
+    @classmethod
+    def shared(cls):
+        """
+        Get the configuration shared by all helpers, config.ini is read once per process.
+
+        Usage:
+        configuration = ConfigHelper.shared()
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def set_overrides(cls, **settings):
+        """
+        Override settings for the shared configuration and every ConfigHelper created afterwards,
+        None values are ignored.
+
+        Usage:
+        ConfigHelper.set_overrides(chunk_size_mb=16, adaptive_chunks=True)
+        """
+        settings = {k: v for k, v in settings.items() if v is not None}
+        cls.overrides.update(settings)
+        if cls._shared is not None:
+            for k, v in settings.items():
+                setattr(cls._shared, k, v)
+
     def restore_defaults(self):
         self.set_configuration(self.config_reader, self.config, CONFIG_DEFAULTS)
+        # The shared configuration is read again on next use
+        ConfigHelper._shared = None
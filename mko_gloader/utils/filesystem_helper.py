@@ -1,9 +1,21 @@
+import hashlib
 import os
 import shutil
+import stat
 import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
+from pathlib import Path
 from .logger import Logger
 from .config_helper import ConfigHelper
+from .scan_index import ScanIndex
+from .path_filter import PathFilter
+
+HASH_BLOCK_SIZE = 1024 * 1024
+# Suffix of files being downloaded, they are not part of the local tree
+DOWNLOAD_PART_SUFFIX = '.gloader.part'
+# Folder next to config.ini keeping deleted files when no backup folder is configured
+BACKUP_FOLDER_NAME = 'backup'
 
 
 class FilesystemHelper:
@@ -19,42 +31,83 @@ class FilesystemHelper:
     def __init__(self, source_folder_path, backup_folder_path: str = None):
         """
         Initialize FilesystemHelper with folder and backup paths.
+
+        The backup folder defaults to the 'backup_path' setting, or to a folder next to config.ini.
         """
-        self.configuration = ConfigHelper()
+        self.configuration = ConfigHelper.shared()
         self.logger = Logger()
         self.SOURCE_FOLDER_PATH = source_folder_path
-        self.BACKUP_FOLDER_PATH = backup_folder_path
+        self.BACKUP_FOLDER_PATH = str(backup_folder_path or self.configuration.backup_folder_path
+                                      or Path(self.configuration.config_path, BACKUP_FOLDER_NAME))
+        self.index = None
+        self.path_filter = PathFilter.from_configuration(self.configuration)
+        # Checksums keyed by (inode, size, mtime) when the scan index is disabled
+        self._md5_cache = {}
 
+    def get_index(self):
+        """
+        Open the scan index of the source folder on first use, returns None if it is disabled.
+        """
+        if self.index is None and self.configuration.use_scan_index:
+            self.index = ScanIndex(self.SOURCE_FOLDER_PATH)
+        return self.index
 
-    def generate_tree_from_filesystem(self, tree):
+    def generate_tree_from_filesystem(self, tree, workers: int = None):
         """
         Generate a tree structure based on the current filesystem.
 
+        Directories are read by a bounded pool of worker threads, while the tree and the scan index
+        are only modified from the calling thread. When the scan index is enabled, directories whose
+        modification time did not change are not listed again and their entries are taken from the index.
+        Paths excluded by the filter are skipped, excluded directories are never read.
+
         Parameters:
         - tree: An instance of the Tree class to store the filesystem structure.
+        - workers: Maximum number of directories read at once, taken from configuration by default.
         """
         try:
-            # Function to add files and subdirectories to the tree
             root_value = os.path.basename(self.SOURCE_FOLDER_PATH)
-            tree.add([root_value])
-
-            def add_recursive(current_node, current_path):
-                for item in os.listdir(current_path):
-                    item_path = os.path.join(current_path, item)
-                    if os.path.isdir(item_path):
-                        # If it's a directory, add it as a child and recurse
-                        child_value = os.path.basename(item_path)
-                        tree.add(current_node + [child_value])
-                        add_recursive(current_node + [child_value], item_path)
-                    else:
-                        # If it's a file, add it directly
-                        # Get Given File Size
-                        file_size = os.path.getsize(item_path)
-                        tree.add(current_node + [item], file_size=file_size)
-
-            # Start the traversal from the root of the tree
-            add_recursive([root_value], self.SOURCE_FOLDER_PATH)
+            tree.add([root_value], is_dir=True)
+            index = self.get_index()
+            if index:
+                # Entries skipped by other patterns are missing from the index
+                index.begin_scan({'filter': self.path_filter.patterns})
 
+            workers = max(1, workers or self.configuration.scan_workers or 1)
+            executor = ThreadPoolExecutor(max_workers=workers)
+            pending = {}
+
+            def submit(node, path):
+                known = index.list_children(path) if index else None
+                dir_entry = index.get(path) if index else None
+                pending[executor.submit(self.read_directory, path, dir_entry, known)] = (node, path, known)
+
+            try:
+                submit(tree.root, '')
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        current_node, current_path, known = pending.pop(future)
+                        dir_stat, items = future.result()
+                        if index:
+                            index.put(current_path, True, dir_stat)
+                        for item, is_dir, item_stat in items:
+                            item_path = f"{current_path}/{item}"
+                            if is_dir:
+                                # If it's a directory, add it as a child and walk into it later
+                                submit(tree.add_child(current_node, item, is_dir=True), item_path)
+                                continue
+                            md5 = None
+                            if index:
+                                entry = known.get(item)
+                                md5 = entry.md5 if ScanIndex.is_unchanged(entry, item_stat) else None
+                                index.put(item_path, False, item_stat, md5)
+                            tree.add_child(current_node, item, is_dir=False, file_size=item_stat.st_size, md5=md5)
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+            if index:
+                index.finish()
         except Exception as e:
             # Log the error using the logger
             self.logger.error(f"Error occurred in generate_tree_from_filesystem: {e}")
@@ -63,6 +116,94 @@ class FilesystemHelper:
             # Raise the exception again to notify the caller about the error
             raise e
 
+    def read_directory(self, path, dir_entry=None, known=None):
+        """
+        Read a directory located in the source folder, safe to call from worker threads.
+
+        Items excluded by the filter are skipped before they are stat'ed.
+
+        Parameters:
+        - path: Path of the directory relative to the source folder, '' for the folder itself.
+        - dir_entry: Scan index entry of the directory, if any.
+        - known: Scan index entries of the directory children keyed by name, None if the index is disabled.
+
+        Returns:
+        The os.stat_result of the directory, None if the index is disabled,
+        and a list of tuples (name, is_dir, stat_result), stat_result is None for directories.
+        """
+        dir_path = self.SOURCE_FOLDER_PATH + path
+        dir_stat = os.stat(dir_path) if known is not None else None
+        items = []
+        if known is not None and ScanIndex.is_unchanged(dir_entry, dir_stat):
+            # Adding, removing or renaming an item always updates the directory modification time
+            for item, entry in known.items():
+                if item.endswith(DOWNLOAD_PART_SUFFIX) or self.path_filter.is_excluded(
+                        f"{path}/{item}", entry.is_dir):
+                    continue
+                try:
+                    item_stat = os.stat(dir_path + '/' + item)
+                except FileNotFoundError:
+                    continue
+                is_dir = stat.S_ISDIR(item_stat.st_mode)
+                items.append((item, is_dir, None if is_dir else item_stat))
+            return dir_stat, items
+
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.name.endswith(DOWNLOAD_PART_SUFFIX):
+                    continue
+                try:
+                    # The entry type comes with the listing, only files need a stat call
+                    is_dir = entry.is_dir()
+                    if self.path_filter.is_excluded(f"{path}/{entry.name}", is_dir):
+                        continue
+                    items.append((entry.name, is_dir, None if is_dir else entry.stat()))
+                except FileNotFoundError:
+                    continue
+        return dir_stat, items
+
+    def get_file_md5(self, path):
+        """
+        Get the MD5 checksum of a file located in the source folder.
+
+        The checksum is cached by (inode, size, mtime), so unchanged files are read only once.
+
+        Parameters:
+        - path: Path of the file relative to the source folder.
+        """
+        try:
+            file_path = self.SOURCE_FOLDER_PATH + path
+            file_stat = os.stat(file_path)
+            index = self.get_index()
+            if index:
+                entry = index.get(path)
+                if ScanIndex.is_unchanged(entry, file_stat) and entry.md5:
+                    return entry.md5
+            else:
+                cache_key = (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+                if cache_key in self._md5_cache:
+                    return self._md5_cache[cache_key]
+
+            md5_hash = hashlib.md5()
+            with open(file_path, 'rb') as file:
+                for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                    md5_hash.update(block)
+            md5 = md5_hash.hexdigest()
+
+            if index:
+                index.put(path, False, file_stat, md5)
+                index.commit()
+            else:
+                self._md5_cache[cache_key] = md5
+            return md5
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in get_file_md5: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+
     def soft_delete_from_filesystem(self, path):
         """
         Soft delete a file or directory from the filesystem.
@@ -28,6 +28,25 @@ from pathlib import Path
 def pathstr_to_list(pathstr: str):
     path = Path(pathstr.strip("\\/"))
     return path.parts
+
+
+def human_bytes(size):
+    """Return the given bytes as a human friendly KB, MB, GB, or TB string"""
+    size = float(size)
+    k_bytes = float(1024)
+    m_bytes = float(k_bytes ** 2)  # 1,048,576
+    g_bytes = float(k_bytes ** 3)  # 1,073,741,824
+    t_bytes = float(k_bytes ** 4)  # 1,099,511,627,776
+
+    if size < k_bytes:
+        return '{0:.0f} {1}'.format(size, 'Byte' if size == 1 else 'Bytes')
+    elif size < m_bytes:
+        return '{0:.2f} KB'.format(size / k_bytes)
+    elif size < g_bytes:
+        return '{0:.2f} MB'.format(size / m_bytes)
+    elif size < t_bytes:
+        return '{0:.2f} GB'.format(size / g_bytes)
+    return '{0:.2f} TB'.format(size / t_bytes)
 #
 #
 #
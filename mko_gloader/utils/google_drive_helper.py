@@ -1,14 +1,48 @@
+import hashlib
 import io
 import os
 import pickle
+import time
 import traceback  # Import traceback module for detailed error information
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from google.oauth2 import service_account
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+# The Google client stack is imported where it is used, it takes long to load
 from .logger import Logger
 from .config_helper import ConfigHelper
+from .chunk_sizer import ChunkSizer, MB, MAX_CHUNK_SIZE
+from .state_helper import StateHelper
+from .path_filter import PathFilter
+from .request_helper import RequestHelper
+from .transport import TransportPool
+from .functions import human_bytes
+from .filesystem_helper import DOWNLOAD_PART_SUFFIX, HASH_BLOCK_SIZE
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+LISTING_MODES = ('auto', 'recursive', 'flat')
+# Limits of a single files.generateIds call and of a single batch request
+GENERATE_IDS_LIMIT = 1000
+BATCH_LIMIT = 100
+# Google Drive keeps resumable sessions for a week, older ones are not worth resuming
+UPLOAD_SESSION_TTL = 6 * 24 * 60 * 60
+UPLOAD_SESSION_STATE = 'upload_session'
+DOWNLOAD_PART_STATE = 'download_part'
+# Earlier snapshots have no checksums or may hold checksums of local files, they are listed again
+SNAPSHOT_VERSION = 2
+
+
+
+class _HashingWriter:
+    """
+    File wrapper updating a checksum with every chunk written through it.
+    """
+
+    def __init__(self, file, md5_hash):
+        self.file = file
+        self.md5_hash = md5_hash
+
+    def write(self, data):
+        self.md5_hash.update(data)
+        return self.file.write(data)
 
 
 class GoogleDriveHelper:
@@ -22,17 +56,21 @@ class GoogleDriveHelper:
                  scopes=None
                  ):
 
-        self.configuration = ConfigHelper()
+        self.configuration = ConfigHelper.shared()
         self.logger = Logger()
 
         cred_path = cred_path or self.configuration.credentials_path
         use_token = use_token or self.configuration.use_token
         scopes = scopes or self.configuration.scopes
-        init_creds = self._set_credentials(cred_path, use_token, scopes)
-        self.service = self.initialize_service(init_creds)
+        self.credentials = self._set_credentials(cred_path, use_token, scopes)
+        self.transport = self.initialize_service(self.credentials)
         self.destination_folder_name = destination_folder if destination_folder else 'root'
         self.parent_folder_id = destination_parent_id if destination_parent_id else 'root'
         self.local_filesystem_folder_path = local_source if local_source else ''
+        self.state = StateHelper()
+        self.path_filter = PathFilter.from_configuration(self.configuration)
+        # Shared by all worker threads, so they back off together
+        self.requests = RequestHelper.shared(self.configuration)
 
     def _set_credentials(self, cred_path, use_token, scopes):
         if os.path.isfile(cred_path):
@@ -51,6 +89,8 @@ class GoogleDriveHelper:
             raise FileNotFoundError
 
     def get_credentials_token(self, credentials_json, token_file, scopes):
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
         try:
             credentials = None
             # The file token.pickle stores the user's access and refresh tokens and is
@@ -83,6 +123,7 @@ class GoogleDriveHelper:
 
     def get_credentials_service(self, credentials_json, scopes):
         """Authenticate to Google API using service account"""
+        from google.oauth2 import service_account
 
         credentials = service_account.Credentials.from_service_account_file(
             filename=credentials_json,
@@ -90,13 +131,26 @@ class GoogleDriveHelper:
 
         return credentials
 
+    @property
+    def service(self):
+        """
+        Google Drive service bound to the calling thread.
+
+        The underlying httplib2 connection is not thread-safe, so every worker
+        thread borrows its own service from the transport pool.
+        """
+        return self.transport.service()
+
     def initialize_service(self, credentials):
         try:
             # Create a Google Drive API service using the saved or new credentials
             print("============================================\nInitializing Google Drive service ...")
-            gd_service = build('drive', 'v3', credentials=credentials)
+            # Services are built by the first request of every thread,
+            # so the Google client stack is only loaded once a command talks to Google Drive
+            transport = TransportPool(credentials, self.configuration.connection_pool_size,
+                                      self.configuration.http_timeout)
             print("Initializing Complete!\n============================================")
-            return gd_service
+            return transport
         except Exception as e:
             # Log the error using the logger
             self.logger.error(f"Error occurred in initialize_service: {e}")
@@ -112,7 +166,7 @@ class GoogleDriveHelper:
             page_token = None
             while True:
                 # pylint: disable=maybe-no-member
-                response = (
+                response = self.requests.execute(
                     self.service.files()
                     .list(
                         q="mimeType='application/vnd.google-apps.folder' and trashed = false",
@@ -122,7 +176,6 @@ class GoogleDriveHelper:
                         fields='nextPageToken, files(id, name)',
                         pageToken=page_token,
                     )
-                    .execute()
                 )
                 folders.extend(response.get("files", []))
                 page_token = response.get("nextPageToken", None)
@@ -144,7 +197,7 @@ class GoogleDriveHelper:
             page_token = None
             while True:
                 # pylint: disable=maybe-no-member
-                response = (
+                response = self.requests.execute(
                     self.service.files()
                     .list(
                         q="sharedWithMe = True",
@@ -154,7 +207,6 @@ class GoogleDriveHelper:
                         fields='nextPageToken, files(id, name, mimeType, trashed, size)',
                         pageToken=page_token,
                     )
-                    .execute()
                 )
                 data.extend(response.get("files", []))
                 page_token = response.get("nextPageToken", None)
@@ -173,14 +225,14 @@ class GoogleDriveHelper:
         if parent_id is None:
             parent_id = self.parent_folder_id
         try:
-            results = self.service.files().list(
+            results = self.requests.execute(self.service.files().list(
                 q=f"mimeType='application/vnd.google-apps.folder' and trashed=false"
                   f" and '{parent_id}' in parents  and name = '{folder_name}'",
                 fields="files(id)",
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
                 pageSize=1000,
-            ).execute()
+            ))
             item = results.get('files', [])
             if len(item) > 1:
                 self.logger.error(f"Multiple folders with same name found: {item}")
@@ -206,67 +258,514 @@ class GoogleDriveHelper:
             last_id = self.get_child_folder_id_by_name(folder_name, last_id, create)
         return last_id
 
-    def generate_tree_from_google_drive(self, tree_root, parent_id=None, path=None):
+    def list_folder(self, folder_id, fields="id, name, mimeType, trashed, size, md5Checksum, parents"):
+        """
+        List all non-trashed items located directly in a Google Drive folder.
+
+        Parameters:
+        - folder_id: ID of the folder to list.
+        - fields: Comma separated file fields to request for each item.
+
+        Returns:
+        A list of file resources.
+        """
+        items = []
+        page_token = None
+        while True:
+            response = self.requests.execute(self.service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+                pageSize=1000,
+                fields=f"nextPageToken, files({fields})",
+                pageToken=page_token,
+            ))
+            items.extend(response.get('files', []))
+            page_token = response.get('nextPageToken', None)
+            if page_token is None:
+                return items
+
+    def list_all_items(self, fields="id, name, mimeType, trashed, size, md5Checksum, parents"):
+        """
+        Page through every non-trashed item visible to the account.
+
+        Parameters:
+        - fields: Comma separated file fields to request, 'parents' is required to rebuild the hierarchy.
+
+        Returns:
+        A list of file resources.
+        """
+        items = []
+        page_token = None
+        while True:
+            response = self.requests.execute(self.service.files().list(
+                q="trashed=false",
+                spaces='drive',
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+                pageSize=1000,
+                fields=f"nextPageToken, files({fields})",
+                pageToken=page_token,
+            ))
+            items.extend(response.get('files', []))
+            page_token = response.get('nextPageToken', None)
+            if page_token is None:
+                return items
+
+    def get_file_id(self, file_id):
+        """
+        Resolve an alias such as 'root' to the real Google Drive file ID.
+        """
+        return self.requests.execute(self.service.files().get(
+            fileId=file_id,
+            supportsAllDrives=True,
+            fields='id'
+        ))['id']
+
+    @staticmethod
+    def _add_item_to_tree(tree_root, parent_node, item):
+        if item['mimeType'] == FOLDER_MIME_TYPE:
+            return tree_root.add_child(parent_node, item['name'], item['id'], is_dir=True)
+        return tree_root.add_child(
+            parent_node, item['name'], item['id'], is_dir=False,
+            file_size=int(item.get('size', 0)),
+            md5=item.get('md5Checksum')
+        )
+
+    @staticmethod
+    def _get_start_node(tree_root, path):
+        """
+        Get the tree node of the folder the listing starts from, creating missing folders on the way.
+        """
+        node, nodes_traversed = tree_root.get_node(path)
+        for name in path[nodes_traversed:]:
+            node = tree_root.add_child(node, name, is_dir=True)
+        return node
+
+    def build_tree_from_items(self, tree_root, items, parent_id, path=None):
+        """
+        Fill the tree from a flat list of items using their parent links.
+
+        Only the subtree located under parent_id is added, everything else is ignored.
+        Items excluded by the filter are skipped with their content.
+
+        Parameters:
+        - tree_root: An instance of the Tree class to store the Google Drive structure.
+        - items: File resources including the 'parents' field.
+        - parent_id: Real ID (not an alias) of the folder to start from.
+        - path: Path of the start folder relative to the destination folder.
+        """
+        children = defaultdict(list)
+        for item in items:
+            for item_parent in item.get('parents', []):
+                children[item_parent].append(item)
+
+        start_path = ''.join(f"/{name}" for name in path or [])
+        queue = deque([(parent_id, self._get_start_node(tree_root, path or []), start_path)])
+        while queue:
+            folder_id, folder_node, folder_path = queue.popleft()
+            # pop() makes sure each folder is expanded only once
+            for item in children.pop(folder_id, []):
+                item_path = f"{folder_path}/{item['name']}"
+                is_dir = item['mimeType'] == FOLDER_MIME_TYPE
+                if self.path_filter.is_excluded(item_path, is_dir):
+                    continue
+                node = self._add_item_to_tree(tree_root, folder_node, item)
+                if is_dir:
+                    queue.append((item['id'], node, item_path))
+
+    def select_listing_mode(self, parent_id, mode=None):
+        """
+        Choose how the remote hierarchy is listed, 'mode' overrides the configured one.
+
+        The flat mode pages through the whole drive, so in 'auto' mode it is used
+        only when the listing starts from the drive root and has to cover everything anyway.
+        Otherwise the per-folder walk is cheaper as it touches the requested subtree only.
+        """
+        mode = (mode or self.configuration.listing_mode or 'auto').lower()
+        if mode not in LISTING_MODES:
+            self.logger.error(f"Unknown listing mode: {mode}, falling back to 'auto'")
+            mode = 'auto'
+        if mode == 'auto':
+            mode = 'flat' if parent_id == 'root' else 'recursive'
+        return mode
+
+    def generate_tree_from_google_drive(self, tree_root, parent_id=None, path=None, workers=None, mode=None):
+        """
+        Fill the tree with the Google Drive hierarchy located under a folder.
+
+        In 'recursive' mode folders are listed breadth-first by a bounded pool of worker threads,
+        while the tree itself is only modified from the calling thread.
+        In 'flat' mode every visible item is listed page by page and the hierarchy is rebuilt
+        from the parent links.
+
+        Parameters:
+        - tree_root: An instance of the Tree class to store the Google Drive structure.
+        - parent_id: ID of the folder to start from, destination folder by default.
+        - path: Path of the start folder relative to the destination folder.
+        - workers: Maximum number of folders listed at once, taken from configuration by default.
+        - mode: 'recursive', 'flat' or 'auto', taken from configuration by default.
+        """
         if parent_id is None:
             parent_id = self.parent_folder_id
         if path is None:
             path = []
+        mode = self.select_listing_mode(parent_id, mode)
+        try:
+            if mode == 'flat':
+                items = self.list_all_items()
+                self.build_tree_from_items(tree_root, items, self.get_file_id(parent_id), path)
+            else:
+                folder_nodes = {parent_id: self._get_start_node(tree_root, path)}
+                walk = self.walk_google_drive(parent_id, workers, path, self.path_filter)
+                for item, folder_id in walk:
+                    node = self._add_item_to_tree(tree_root, folder_nodes[folder_id], item)
+                    if item['mimeType'] == FOLDER_MIME_TYPE:
+                        folder_nodes[item['id']] = node
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in generate_tree_from_google_drive: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+
+    def walk_google_drive(self, parent_id, workers=None, path=None, path_filter=None):
+        """
+        Walk the Google Drive hierarchy located under a folder breadth-first.
+
+        Folders are listed by a bounded pool of worker threads, items are yielded
+        in the calling thread as soon as their folder listing completes.
+        A folder is always yielded before its content.
+
+        Parameters:
+        - parent_id: ID of the folder to start from.
+        - workers: Maximum number of folders listed at once, taken from configuration by default.
+        - path: Path of the start folder relative to the destination folder, used by the filter.
+        - path_filter: PathFilter, excluded items are not yielded and excluded folders are not listed.
+
+        Yields:
+        Tuples of file resource and the ID of the listed folder containing it.
+        """
+        workers = max(1, workers or self.configuration.list_workers or 1)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = {}
         try:
-            results = self.service.files().list(
-                q=f"'{parent_id}' in parents and trashed=false",
+            start_path = ''.join(f"/{name}" for name in path or [])
+            pending[executor.submit(self.list_folder, parent_id)] = (parent_id, start_path)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder_id, folder_path = pending.pop(future)
+                    for item in future.result():
+                        item_path = f"{folder_path}/{item['name']}"
+                        is_dir = item['mimeType'] == FOLDER_MIME_TYPE
+                        if path_filter and path_filter.is_excluded(item_path, is_dir):
+                            continue
+                        if is_dir:
+                            pending[executor.submit(self.list_folder, item['id'])] = (item['id'], item_path)
+                        yield item, folder_id
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def get_start_page_token(self):
+        """
+        Get the Changes API token pointing to the current state of the drive.
+        """
+        return self.requests.execute(self.service.changes().getStartPageToken(
+            supportsAllDrives=True
+        ))['startPageToken']
+
+    def list_changes(self, page_token):
+        """
+        List every change made since the page token was issued.
+
+        Parameters:
+        - page_token: Token returned by get_start_page_token or by a previous call.
+
+        Returns:
+        A list of change resources and the token to use for the next call.
+        """
+        changes = []
+        while True:
+            response = self.requests.execute(self.service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
+                includeRemoved=True,
                 pageSize=1000,
-                fields="nextPageToken, files(id, name, mimeType, trashed, size)"
-            ).execute()
-            items = results.get('files', [])
+                fields="nextPageToken, newStartPageToken, changes(changeType, removed, fileId, "
+                       "file(id, name, mimeType, trashed, size, md5Checksum, parents))"
+            ))
+            changes.extend(response.get('changes', []))
+            if 'newStartPageToken' in response:
+                return changes, response['newStartPageToken']
+            page_token = response['nextPageToken']
 
-            for i, item in enumerate(items):
-                if item['mimeType'] == 'application/vnd.google-apps.folder':
-                    tree_root.add(
-                        [self.destination_folder_name] + path + [item['name']],
-                        item['id'],
-                        is_dir=True
-                    )
-                    self.generate_tree_from_google_drive(
-                        tree_root,
-                        item['id'],
-                        path + [item['name']]
-                    )
+    @staticmethod
+    def items_from_tree(tree_root, root_id):
+        """
+        Flatten a Google Drive tree into items keyed by ID with their parent links.
+
+        Parameters:
+        - tree_root: An instance of the Tree class filled from Google Drive.
+        - root_id: Real ID of the tree root folder.
+
+        Returns:
+        A dictionary of file resources keyed by ID.
+        """
+        items = {}
+        stack = [(tree_root.root, root_id)]
+        while stack:
+            node, node_id = stack.pop()
+            for name, child in node.children.items():
+                item = items.get(child.id)
+                if item is None:
+                    items[child.id] = {
+                        'id': child.id,
+                        'name': name,
+                        'mimeType': FOLDER_MIME_TYPE if child.isDir else '',
+                        'size': child.fileSize,
+                        'md5Checksum': child.md5,
+                        'parents': [node_id]
+                    }
+                    if child.isDir:
+                        stack.append((child, child.id))
+                elif node_id not in item['parents']:
+                    # The same file placed in several folders
+                    item['parents'].append(node_id)
+        return items
+
+    def apply_changes(self, items, changes, root_id):
+        """
+        Apply Changes API records to the items of a snapshot.
+
+        Folders that were not known before are listed completely, as a folder moved
+        into the tree from elsewhere does not report its content as changes.
+
+        Parameters:
+        - items: Dictionary of file resources keyed by ID, updated in place.
+        - changes: Change resources returned by list_changes.
+        - root_id: Real ID of the tree root folder.
+        """
+        new_folders = []
+        for change in changes:
+            if change.get('changeType', 'file') != 'file':
+                continue
+            file_id = change['fileId']
+            file = change.get('file')
+            if change.get('removed') or not file or file.get('trashed'):
+                items.pop(file_id, None)
+                continue
+            if file['mimeType'] == FOLDER_MIME_TYPE and file_id not in items:
+                new_folders.append(file_id)
+            items[file_id] = file
+
+        known_folders = {root_id} | {i for i, item in items.items() if item['mimeType'] == FOLDER_MIME_TYPE}
+        for folder_id in new_folders:
+            if not known_folders.intersection(items[folder_id].get('parents', [])):
+                # Created or moved somewhere outside the tree, dropped when the tree is rebuilt
+                continue
+            for item, _ in self.walk_google_drive(folder_id):
+                items.setdefault(item['id'], item)
+
+    def generate_tree_from_snapshot(self, tree_root, snapshot=None):
+        """
+        Fill the tree with the destination folder hierarchy reusing a snapshot from a previous run.
+
+        Only the changes made since the snapshot are requested from the Changes API.
+        A full listing is done if there is no snapshot, it was saved by an earlier version
+        or its page token is no longer valid.
+
+        Parameters:
+        - tree_root: An instance of the Tree class to store the Google Drive structure.
+        - snapshot: Dictionary returned by a previous call or None.
+
+        Returns:
+        A new snapshot to be persisted until the next run.
+        """
+        from googleapiclient.errors import HttpError
+        try:
+            # Items excluded by other patterns are missing from the snapshot
+            if (snapshot and snapshot.get('version') == SNAPSHOT_VERSION and snapshot.get('page_token')
+                    and snapshot.get('filter', []) == self.path_filter.patterns):
+                try:
+                    changes, page_token = self.list_changes(snapshot['page_token'])
+                except HttpError as error:
+                    # Expired or invalid token, the snapshot can't be brought up to date
+                    self.logger.info(f"Changes API token rejected, full listing required: {error}")
                 else:
-                    tree_root.add(
-                        [self.destination_folder_name] + path + [item['name']],
-                        item['id'], is_dir=False,
-                        file_size=item['size']
-                    )
+                    items = {item['id']: item for item in snapshot['items']}
+                    self.apply_changes(items, changes, snapshot['root_id'])
+                    self.build_tree_from_items(tree_root, items.values(), snapshot['root_id'])
+                    return {
+                        'version': SNAPSHOT_VERSION,
+                        'root_id': snapshot['root_id'],
+                        'page_token': page_token,
+                        'filter': self.path_filter.patterns,
+                        'items': list(self.items_from_tree(tree_root, snapshot['root_id']).values())
+                    }
+
+            # The token is taken before listing, so nothing done meanwhile is missed next time
+            page_token = self.get_start_page_token()
+            root_id = self.get_file_id(self.parent_folder_id)
+            self.generate_tree_from_google_drive(tree_root)
+            return {
+                'version': SNAPSHOT_VERSION,
+                'root_id': root_id,
+                'page_token': page_token,
+                'filter': self.path_filter.patterns,
+                'items': list(self.items_from_tree(tree_root, root_id).values())
+            }
         except Exception as e:
             # Log the error using the logger
-            self.logger.error(f"Error occurred in generate_tree_from_google_drive: {e}")
+            self.logger.error(f"Error occurred in generate_tree_from_snapshot: {e}")
             # Optionally, log the full traceback for detailed error information
             self.logger.error(traceback.format_exc())
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def upload_file(self, file_path, folder_id):
+    def new_chunk_sizer(self):
+        """
+        Create the chunk size policy for a single upload or download from configuration.
+        """
+        max_size = int((self.configuration.max_chunk_size_mb or MAX_CHUNK_SIZE / MB) * MB)
+        return ChunkSizer(int(self.configuration.chunk_size_mb * MB), self.configuration.adaptive_chunks,
+                          max_size=max_size)
+
+    def _next_chunk(self, sizer, media, next_chunk, method):
+        """
+        Transfer the next chunk with the size picked by the sizer.
+
+        A chunk failed with a retryable error is sent again by the request helper,
+        in adaptive mode with a smaller size.
+
+        Parameters:
+        - sizer: ChunkSizer of the transfer.
+        - media: MediaFileUpload or MediaIoBaseDownload of the transfer.
+        - next_chunk: Callable sending the next chunk.
+        - method: Name of the request in the metrics.
+
+        Returns:
+        The result of next_chunk and the time it took.
+        """
+        def send():
+            # There is no public setter, the size is read from this attribute for every chunk
+            media._chunksize = sizer.chunk_size
+            started = time.monotonic()
+            return next_chunk(), time.monotonic() - started
+
+        return self.requests.call(send, on_retry=sizer.record_error, method=method)
+
+    def prune_upload_sessions(self):
+        """
+        Remove saved resumable upload sessions that are too old to be resumed.
+        """
+        self.state.prune(UPLOAD_SESSION_STATE, UPLOAD_SESSION_TTL)
+
+    def upload_file(self, file_path, folder_id, file_id=None):
+        """
+        Upload a file located in the local source folder.
+
+        Parameters:
+        - file_path: Path of the file relative to the local source folder.
+        - folder_id: ID of the Google Drive folder to upload to, ignored when file_id is set.
+        - file_id: ID of an existing Google Drive file to replace the content of in place.
+
+        Returns:
+        ID of the uploaded file.
+        """
+        return self.upload_file_metadata(file_path, folder_id, file_id)['id']
+
+    def upload_file_metadata(self, file_path, folder_id, file_id=None):
+        """
+        Upload a file located in the local source folder, like upload_file.
+
+        Files smaller than the multipart threshold are sent with a single request,
+        larger ones go through a resumable session.
+
+        Returns:
+        Dictionary with the 'id' and the 'md5Checksum' of the uploaded file.
+        """
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaFileUpload
         try:
             file_name = os.path.basename(file_path)
-            media_body = MediaFileUpload(self.local_filesystem_folder_path + file_path, resumable=True)
-            request = self.service.files().create(
-                supportsAllDrives=True,
-                media_body=media_body,
-                body={
-                    'name': file_name,
-                    'parents': [folder_id]
-                }
-            )
-            response = None
+            local_path = self.local_filesystem_folder_path + file_path
+            resumable = os.path.getsize(local_path) >= self.configuration.multipart_threshold_mb * MB
+            sizer = self.new_chunk_sizer()
+            media_body = MediaFileUpload(local_path, chunksize=sizer.chunk_size, resumable=resumable)
+            if file_id:
+                # Keeps the file ID, so shares and links stay valid
+                request = self.service.files().update(
+                    supportsAllDrives=True,
+                    fileId=file_id,
+                    media_body=media_body,
+                    fields='id, md5Checksum'
+                )
+            else:
+                request = self.service.files().create(
+                    supportsAllDrives=True,
+                    media_body=media_body,
+                    body={
+                        'name': file_name,
+                        'parents': [folder_id]
+                    },
+                    fields='id, md5Checksum'
+                )
             print(f"===============================\nStarting upload for: {file_name}")
+            if not resumable:
+                response = self.requests.execute(request)
+                print(f"Upload complete!\nFile path: {file_path}\n===============================")
+                return response
+
+            # The session is bound to the exact file version and target
+            file_stat = os.stat(local_path)
+            session_key = (f"{os.path.abspath(local_path)}|{file_stat.st_size}|{file_stat.st_mtime_ns}|"
+                           f"{file_id or folder_id}")
+            session = self.state.load(UPLOAD_SESSION_STATE, session_key)
+            resumed = bool(session and time.time() - session['created'] < UPLOAD_SESSION_TTL)
+            if resumed:
+                request.resumable_uri = session['uri']
+                request.resumable_progress = session['offset']
+                # Makes the next chunk ask the server for the committed offset first
+                request._in_error_state = True
+                print(f"Resuming upload from {human_bytes(session['offset'])}")
+            created = session['created'] if resumed else time.time()
+
+            response = None
+            progress = request.resumable_progress
             while response is None:
-                status, response = request.next_chunk()
+                try:
+                    (status, response), elapsed = self._next_chunk(
+                        sizer, media_body, request.next_chunk, 'upload_chunk')
+                except HttpError as error:
+                    if not resumed or error.resp.status not in (404, 410):
+                        raise
+                    # The session has expired on the server, start a new one
+                    self.state.drop(UPLOAD_SESSION_STATE, session_key)
+                    request.resumable_uri, request.resumable_progress, request._in_error_state = None, 0, False
+                    resumed, progress, created = False, 0, time.time()
+                    continue
+                resumed = False
+                sent = (status.resumable_progress if status else media_body.size()) - progress
+                progress += sent
+                sizer.record(sent, elapsed)
+                if status:
+                    self.state.save(UPLOAD_SESSION_STATE, session_key, {
+                        'uri': request.resumable_uri,
+                        'offset': status.resumable_progress,
+                        'created': created
+                    })
+            self.state.drop(UPLOAD_SESSION_STATE, session_key)
             print(f"Upload complete!\nFile path: {file_path}\n===============================")
+            return response
         except Exception as e:
             # Log the error using the logger
-            self.logger.error(f"Error occurred in upload_file: {e}")
+            self.logger.error(f"Error occurred in upload_file_metadata: {e}")
             # Optionally, log the full traceback for detailed error information
             self.logger.error(traceback.format_exc())
             # Raise the exception again to notify the caller about the error
@@ -279,11 +778,11 @@ class GoogleDriveHelper:
                 'mimeType': 'application/vnd.google-apps.folder',
                 'parents': [parent_folder_id]
             }
-            folder = self.service.files().create(
+            folder = self.requests.execute(self.service.files().create(
                 supportsAllDrives=True,
                 body=folder_metadata,
                 fields='id'
-            ).execute()
+            ))
             return folder['id']
         except Exception as e:
             # Log the error using the logger
@@ -293,90 +792,90 @@ class GoogleDriveHelper:
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def create_folders_for_upload(self, names, parent_folder_id):
+    def generate_ids(self, count):
+        """
+        Reserve IDs for files and folders to be created.
+
+        Parameters:
+        - count: Number of IDs to reserve.
+
+        Returns:
+        A list of IDs.
+        """
         try:
-            last_id = parent_folder_id
-            for name in names:
-                folder_metadata = {
-                    'name': name,
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [last_id]
-                }
-                folder = self.service.files().create(
-                    supportsAllDrives=True,
-                    body=folder_metadata,
-                    fields='id'
-                ).execute()
-                last_id = folder['id']
-            return last_id
+            ids = []
+            while len(ids) < count:
+                response = self.requests.execute(self.service.files().generateIds(
+                    count=min(GENERATE_IDS_LIMIT, count - len(ids)),
+                    space='drive',
+                    type='files'
+                ))
+                ids.extend(response['ids'])
+            return ids
         except Exception as e:
             # Log the error using the logger
-            self.logger.error(f"Error occurred in create_folders_for_upload: {e}")
+            self.logger.error(f"Error occurred in generate_ids: {e}")
             # Optionally, log the full traceback for detailed error information
             self.logger.error(traceback.format_exc())
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def upload_folder(self, folder_path, parent_folder_id):
+    def create_folders(self, folders):
+        """
+        Create folders with reserved IDs using batch requests.
+
+        The order of requests inside a batch is not guaranteed, so parent folders
+        must already exist or be created by a previous call.
+
+        Parameters:
+        - folders: Tuples (folder_id, folder_name, parent_folder_id).
+        """
+        def create_request(folder_id, folder_name, parent_folder_id):
+            return lambda: self.service.files().create(
+                supportsAllDrives=True,
+                body={
+                    'id': folder_id,
+                    'name': folder_name,
+                    'mimeType': FOLDER_MIME_TYPE,
+                    'parents': [parent_folder_id]
+                },
+                fields='id'
+            )
+
         try:
-            folder_name = os.path.basename(folder_path)
-            folder_id = self.create_folder(folder_name, parent_folder_id)
-
-            for item in os.listdir(self.local_filesystem_folder_path + folder_path):
-                item_path = os.path.join(folder_path, item)
-                if os.path.isfile(self.local_filesystem_folder_path + item_path):
-                    self.upload_file(item_path, folder_id)
-                elif os.path.isdir(self.local_filesystem_folder_path + item_path):
-                    self.upload_folder(item_path, folder_id)
-
-            print(
-                f"===============================\nUpload complete for folder: {folder_name}.\n"
-                f"===============================")
+            errors = self.requests.execute_batch(
+                lambda callback: self.service.new_batch_http_request(callback=callback),
+                {folder[0]: create_request(*folder) for folder in folders},
+                BATCH_LIMIT
+            )
+            if errors:
+                raise RuntimeError(f"Failed to create {len(errors)} folders, "
+                                   f"first error: {next(iter(errors.values()))}")
         except Exception as e:
             # Log the error using the logger
-            self.logger.error(f"Error occurred in upload_folder: {e}")
+            self.logger.error(f"Error occurred in create_folders: {e}")
             # Optionally, log the full traceback for detailed error information
             self.logger.error(traceback.format_exc())
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def upload_helper(self, gdrive_tree, folder_path):
+    def bulk_delete(self, ids):
+        def delete_request(file_id):
+            return lambda: self.service.files().delete(fileId=file_id)
+
         try:
-            folder_path = folder_path[0]
-            to_upload_path = folder_path.split("/")
-            nearest_node, folders_already_created = gdrive_tree.get_node(to_upload_path[1:])
-            final_id = nearest_node.id
-            if folders_already_created != len(to_upload_path[1:-1]):
-                final_id = self.create_folders_for_upload(to_upload_path[folders_already_created + 1:], nearest_node.id)
-            self.upload_file(folder_path, final_id) if not os.path.isdir(
-                self.local_filesystem_folder_path + folder_path) else self.upload_folder(
-                folder_path, final_id)
-        except Exception as e:
-            # Log the error using the logger
-            self.logger.error(f"Error occurred in upload_helper: {e}")
+            # Requests of a batch failed with retryable errors are resent after the backoff
+            errors = self.requests.execute_batch(
+                lambda callback: self.service.new_batch_http_request(callback=callback),
+                {file_id: delete_request(file_id) for file_id in ids},
+                BATCH_LIMIT
+            )
+            for file_id, error in errors.items():
+                print(f"Failed to delete {file_id}: {error}")
+        except Exception as error:
+            self.logger.error(f"Error occurred in bulk_delete: {error}")
             # Optionally, log the full traceback for detailed error information
             self.logger.error(traceback.format_exc())
-            # Raise the exception again to notify the caller about the error
-            raise e
-
-    def bulk_delete(self, ids):
-        def callback(request_id, response, exception):
-            if not exception:
-                print(response)
-            else:
-                print(exception)
-
-        for i in range(0, len(ids), 100):
-            batch = self.service.new_batch_http_request(callback=callback)
-            for file_id in ids[i:i + 100]:
-                batch.add(self.service.files().delete(fileId=file_id))
-            try:
-                print(batch.execute())
-            except Exception as error:
-                self.logger.error(f"Error occurred in bulk_delete: {error}")
-                # Optionally, log the full traceback for detailed error information
-                self.logger.error(traceback.format_exc())
-                # Raise the exception again to notify the caller about the error
 
     def cleanup_folder_by_id(self, folder_id):
         files_to_delete = self.list_content_by_id(folder_id)
@@ -390,7 +889,7 @@ class GoogleDriveHelper:
             page_token = None
             while True:
                 # pylint: disable=maybe-no-member
-                response = (
+                response = self.requests.execute(
                     self.service.files()
                     .list(
                         q=f"'{folder_id}' in parents and trashed = false",  # mimeType='application/vnd.google-apps' and
@@ -400,7 +899,6 @@ class GoogleDriveHelper:
                         fields='nextPageToken, files(id, name)',
                         pageToken=page_token,
                     )
-                    .execute()
                 )
                 content.extend(response.get("files", []))
                 page_token = response.get("nextPageToken", None)
@@ -417,10 +915,10 @@ class GoogleDriveHelper:
 
     def hard_delete_file(self, file_id):
         try:
-            self.service.files().delete(
+            self.requests.execute(self.service.files().delete(
                 supportsAllDrives=True,
                 fileId=file_id
-            ).execute()
+            ))
             print(f"File/Folder with ID {file_id} deleted successfully.")
         except Exception as e:
             # Log the error using the logger
@@ -433,18 +931,14 @@ class GoogleDriveHelper:
     def delete_file(self, file_id, gdrive_tree=None):
         try:
             body_value = {'trashed': True}
-            self.service.files().update(
+            self.requests.execute(self.service.files().update(
                 supportsAllDrives=True,
                 fileId=file_id,
                 body=body_value
-            ).execute()
+            ))
 
-            parent_node_of_file = gdrive_tree.find_parent_node_by_id(file_id)
-            if parent_node_of_file:
-                for file_name in parent_node_of_file.children:
-                    if parent_node_of_file.children[file_name].id == file_id:
-                        del parent_node_of_file.children[file_name]
-                        break
+            if gdrive_tree:
+                gdrive_tree.remove_by_id(file_id)
 
             print(f"File/Folder with ID {file_id} moved to trash successfully.")
         except Exception as e:
@@ -455,26 +949,68 @@ class GoogleDriveHelper:
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def download_file(self, output_path, drive_file_id):
+    def download_file(self, output_path, drive_file_id, file_size=None, md5=None):
+        """
+        Download a file into the local source folder.
+
+        The content is written to a '.gloader.part' file first and moved into place once complete.
+        A part file left by an interrupted run is continued with a byte range request, but only
+        if it was written from the same version of the file, as identified by its checksum.
+
+        Parameters:
+        - output_path: Path of the file relative to the local source folder.
+        - drive_file_id: ID of the Google Drive file.
+        - file_size: Expected size of the file, used to validate the part file.
+        - md5: Checksum of the Google Drive file, used to validate the part file and the result.
+        """
         try:
             request = self.service.files().get_media(
                 supportsAllDrives=True,
-                includeItemsFromAllDrives=True,
                 fileId=drive_file_id
             )
 
-            dir_path = (self.local_filesystem_folder_path + output_path).removesuffix(
-                os.path.basename((self.local_filesystem_folder_path + output_path)))
-            os.makedirs(dir_path, exist_ok=True)
+            file_path = self.local_filesystem_folder_path + output_path
+            part_path = file_path + DOWNLOAD_PART_SUFFIX
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
 
-            with io.FileIO(self.local_filesystem_folder_path + output_path, 'wb') as output_file:
-                downloader = MediaIoBaseDownload(output_file, request)
-                done = False
+            file_size = int(file_size) if file_size not in (None, '') else None
+            part_key = os.path.abspath(part_path)
+            offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+            if offset:
+                part = self.state.load(DOWNLOAD_PART_STATE, part_key)
+                if (md5 is None or not part or part.get('md5') != md5
+                        or file_size is not None and offset > file_size):
+                    # Left from another version of the file, or from a version that can't be told
+                    offset = 0
+                    os.remove(part_path)
+            if md5 is not None:
+                self.state.save(DOWNLOAD_PART_STATE, part_key, {'md5': md5})
 
-                print(f"===============================\nStarting download for: {output_path.split('/')[-1]}")
+            print(f"===============================\nStarting download for: {output_path.split('/')[-1]}")
+            if offset:
+                print(f"Resuming download from {human_bytes(offset)}")
 
-                while not done:
-                    status, done = downloader.next_chunk()
+            # The checksum is updated from the chunks as they are written, only a resumed part is read back
+            md5_hash = None
+            if md5 is not None:
+                md5_hash = self._file_md5(part_path) if offset else hashlib.md5()
+
+            if file_size == 0:
+                # Nothing to request, a byte range of an empty file is rejected
+                open(part_path, 'wb').close()
+            elif file_size is None or offset < file_size:
+                md5_hash = self._download_to_part(request, part_path, offset, md5_hash)
+
+            if file_size is not None and os.path.getsize(part_path) != file_size:
+                os.remove(part_path)
+                self.state.drop(DOWNLOAD_PART_STATE, part_key)
+                raise IOError(f"Downloaded size of {output_path} does not match {file_size} bytes")
+            if md5_hash is not None and md5_hash.hexdigest() != md5:
+                os.remove(part_path)
+                self.state.drop(DOWNLOAD_PART_STATE, part_key)
+                raise IOError(f"Downloaded checksum of {output_path} does not match {md5}")
+            os.replace(part_path, file_path)
+            self.state.drop(DOWNLOAD_PART_STATE, part_key)
 
             print(f"Download complete!\nFile saved to: {output_path}\n===============================")
         except Exception as e:
@@ -485,56 +1021,64 @@ class GoogleDriveHelper:
             # Raise the exception again to notify the caller about the error
             raise e
 
-    def download_folder(self, output_path, drive_folder_id):
-        try:
-            os.makedirs(self.local_filesystem_folder_path + output_path, exist_ok=True)
+    @staticmethod
+    def _file_md5(file_path):
+        md5_hash = hashlib.md5()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                md5_hash.update(block)
+        return md5_hash
 
-            results = self.service.files().list(
-                q=f"parents in '{drive_folder_id}'",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True,
-                fields="files(id, name, mimeType)"
-            ).execute()
-            items = results.get('files', [])
+    def _download_to_part(self, request, part_path, offset, md5_hash=None):
+        """
+        Download a file into its part file, appending to the first offset bytes.
 
-            for item in items:
-                if item['mimeType'] == 'application/vnd.google-apps.folder':
-                    subfolder_path = os.path.join(output_path, item['name'])
-                    self.download_folder(subfolder_path, item['id'])
-                else:
-                    file_path = os.path.join(output_path, item['name'])
-                    self.download_file(file_path, item['id'])
+        Parameters:
+        - request: get_media request of the file.
+        - part_path: Path of the part file.
+        - offset: Size of the part file written by a previous run.
+        - md5_hash: Checksum of the part file content updated with every written chunk, or None.
 
-        except Exception as e:
-            # Log the error using the logger
-            self.logger.error(f"Error occurred in download_folder: {e}")
-            # Optionally, log the full traceback for detailed error information
-            self.logger.error(traceback.format_exc())
-            # Raise the exception again to notify the caller about the error
-            raise e
+        Returns:
+        The checksum of the whole part file, or None.
+        """
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaIoBaseDownload
+        with io.FileIO(part_path, 'ab' if offset else 'wb') as output_file:
+            sizer = self.new_chunk_sizer()
+            writer = output_file if md5_hash is None else _HashingWriter(output_file, md5_hash)
+            downloader = MediaIoBaseDownload(writer, request, chunksize=sizer.chunk_size)
+            # The Range header of every chunk starts from this attribute
+            downloader._progress = offset
+            done = False
+            progress = offset
 
-    def download_helper(self, output_path, drive_folder_id, is_dir):
-        try:
-            if not is_dir:
-                self.download_file(output_path, drive_folder_id)
-            else:
-                self.download_folder(output_path, drive_folder_id)
-        except Exception as e:
-            # Log the error using the logger
-            self.logger.error(f"Error occurred in download_helper: {e}")
-            # Optionally, log the full traceback for detailed error information
-            self.logger.error(traceback.format_exc())
-            # Raise the exception again to notify the caller about the error
-            raise e
+            while not done:
+                try:
+                    (status, done), elapsed = self._next_chunk(
+                        sizer, downloader, downloader.next_chunk, 'download_chunk')
+                except HttpError as error:
+                    if error.resp.status != 416 or not progress:
+                        raise
+                    # The part file is not shorter than the remote file, download it again
+                    output_file.truncate(0)
+                    output_file.seek(0)
+                    downloader._progress = progress = 0
+                    if md5_hash is not None:
+                        md5_hash = writer.md5_hash = hashlib.md5()
+                    continue
+                sizer.record(status.resumable_progress - progress, elapsed)
+                progress = status.resumable_progress
+        return md5_hash
 
     def list_trash(self):
         try:
-            results = self.service.files().list(
+            results = self.requests.execute(self.service.files().list(
                 q=f"trashed=True",
                 fields="files(id,name)",
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
-            ).execute()
+            ))
             items = results.get('files', [])
             if not items:
                 print("No trashed files.")
@@ -551,7 +1095,7 @@ class GoogleDriveHelper:
 
     def clear_trash(self):
         try:
-            self.service.files().emptyTrash().execute()
+            self.requests.execute(self.service.files().emptyTrash())
             print("All trash cleaned up")
         except Exception as e:
             # Log the error using the logger
@@ -568,10 +1112,10 @@ class GoogleDriveHelper:
                 'role': role,
                 'emailAddress': email
             }
-            self.service.permissions().create(
+            self.requests.execute(self.service.permissions().create(
                 fileId=file_id,
                 body=permission
-            ).execute()
+            ))
         except Exception as e:
             # Log the error using the logger
             self.logger.error(f"Error occurred in grant_permissions: {e}")
@@ -585,13 +1129,13 @@ class GoogleDriveHelper:
         permission_list = []
         try:
             while True:
-                response = self.service.permissions().list(
+                response = self.requests.execute(self.service.permissions().list(
                     fileId=file_id,
                     supportsAllDrives=True,
                     includeItemsFromAllDrives=True,
                     fields='permissions/id,permissions/displayName,permissions/role,permissions/emailAddress',
                     pageToken=page_token,
-                ).execute()
+                ))
                 permission_list.extend(response.get('permissions', []))
                 if page_token is None:
                     break
@@ -615,11 +1159,11 @@ class GoogleDriveHelper:
     def drop_permission(self, file_id, permission_id):
         # delete perms using the id
         try:
-            self.service.permissions().delete(
+            self.requests.execute(self.service.permissions().delete(
                 fileId=file_id,
                 permissionId=permission_id,
                 supportsAllDrives=True
-            ).execute()
+            ))
 
         except Exception as e:
             # Log the error using the logger
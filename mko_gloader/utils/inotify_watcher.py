@@ -0,0 +1,196 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from .logger import Logger
+from .filesystem_helper import DOWNLOAD_PART_SUFFIX
+
+# Event flags from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+class InotifyWatcher:
+    """
+    Watches a local folder and its subdirectories for changes using Linux inotify.
+
+    Every touched path is reported relative to the folder, bursts of events are coalesced
+    until the folder stays quiet for the debounce period. Waiting for events costs nothing
+    while the folder is idle.
+
+    Usage:
+    watcher = InotifyWatcher("/home/user/data", path_filter)
+    paths = watcher.wait_for_changes(debounce=2)
+    watcher.close()
+    """
+
+    def __init__(self, source_folder_path, path_filter=None):
+        """
+        Start watching the folder.
+
+        Parameters:
+        - source_folder_path: Folder to watch.
+        - path_filter: PathFilter, excluded paths are neither watched nor reported.
+        """
+        self.logger = Logger()
+        self.SOURCE_FOLDER_PATH = source_folder_path
+        self.path_filter = path_filter
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1 failed: {os.strerror(error)}")
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+        self._paths = {}
+        self._watches = {}
+        self.add_watches('')
+
+    def _is_excluded(self, path, is_dir):
+        name = path.rsplit('/', 1)[-1]
+        return name.endswith(DOWNLOAD_PART_SUFFIX) or bool(
+            self.path_filter and self.path_filter.is_excluded(path, is_dir))
+
+    def add_watches(self, path):
+        """
+        Watch a directory and every directory below it.
+
+        Parameters:
+        - path: Path of the directory relative to the source folder, '' for the folder itself.
+        """
+        stack = [path]
+        while stack:
+            dir_path = stack.pop()
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(self.SOURCE_FOLDER_PATH + dir_path), WATCH_MASK)
+            if wd < 0:
+                # Removed meanwhile, or the watch limit is reached
+                self.logger.error(f"Can't watch {dir_path or '/'}: {os.strerror(ctypes.get_errno())}")
+                continue
+            if wd in self._paths:
+                # A directory reached again through a symlink, its events keep the first path
+                continue
+            self._paths[wd] = dir_path
+            self._watches[dir_path] = wd
+            try:
+                with os.scandir(self.SOURCE_FOLDER_PATH + dir_path) as entries:
+                    for entry in entries:
+                        entry_path = f"{dir_path}/{entry.name}"
+                        # Symlinked directories are followed, like the scanner does
+                        if entry.is_dir() and not self._is_excluded(entry_path, True):
+                            stack.append(entry_path)
+            except FileNotFoundError:
+                continue
+
+    def remove_watches(self, path):
+        """
+        Stop watching a directory and every directory below it.
+        """
+        prefix = path + '/'
+        for dir_path in [p for p in self._watches if p == path or p.startswith(prefix)]:
+            wd = self._watches.pop(dir_path)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout=None):
+        """
+        Wait for events and return the touched paths.
+
+        Parameters:
+        - timeout: Seconds to wait, None to wait until something happens.
+
+        Returns:
+        A set of paths relative to the source folder, or None if the kernel queue overflowed
+        and events were lost.
+        """
+        if not self._poll.poll(None if timeout is None else max(0, int(timeout * 1000))):
+            return set()
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return set()
+
+        paths, overflow, offset = set(), False, 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                dir_path = self._paths.pop(wd, None)
+                if dir_path is not None and self._watches.get(dir_path) == wd:
+                    del self._watches[dir_path]
+                continue
+            dir_path = self._paths.get(wd)
+            if dir_path is None or not name:
+                continue
+            path = f"{dir_path}/{os.fsdecode(name)}"
+            is_dir = bool(mask & IN_ISDIR)
+            if self._is_excluded(path, is_dir):
+                continue
+            paths.add(path)
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                # Items created before the watch is added are covered by the directory itself
+                self.add_watches(path)
+            elif is_dir and mask & (IN_MOVED_FROM | IN_DELETE):
+                self.remove_watches(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(self.SOURCE_FOLDER_PATH + path):
+                # A symlink to a directory
+                self.add_watches(path)
+            elif mask & (IN_MOVED_FROM | IN_DELETE) and path in self._watches:
+                self.remove_watches(path)
+        return None if overflow else paths
+
+    def wait_for_changes(self, debounce=2.0, max_delay=30.0):
+        """
+        Wait until something changes and the folder stays quiet for the debounce period.
+
+        Parameters:
+        - debounce: Seconds without events ending a burst.
+        - max_delay: Seconds after the first event the paths are returned even if events keep coming.
+
+        Returns:
+        A set of touched paths, or None if events were lost and the folder has to be rescanned.
+        """
+        paths = set()
+        while not paths:
+            paths = self.read_events()
+            if paths is None:
+                return None
+        deadline = time.monotonic() + max_delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return paths
+            more = self.read_events(min(debounce, remaining))
+            if more is None:
+                return None
+            if not more:
+                return paths
+            paths |= more
+
+    def close(self):
+        """
+        Stop watching.
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
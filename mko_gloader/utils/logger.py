@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime
 from .config_helper import ConfigHelper
 
@@ -18,11 +19,14 @@ class Logger:
         self.logger.setLevel(logging.INFO)
 
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%d-%m-%y %I:%M:%S %p')
-        configuration = ConfigHelper()
+        configuration = ConfigHelper.shared()
         logs_folder_path = logs_folder_path or configuration.logs_folder_path
         if logs_folder_path:
-            file_handler = logging.FileHandler(
-                logs_folder_path + "/" + datetime.now().strftime("%d-%m-%y") + ".log")
+            log_path = os.path.abspath(logs_folder_path + "/" + datetime.now().strftime("%d-%m-%y") + ".log")
+            # Every helper creates a Logger, the file handler is added once per log file
+            if any(getattr(handler, 'baseFilename', None) == log_path for handler in self.logger.handlers):
+                return
+            file_handler = logging.FileHandler(log_path)
             file_handler.setFormatter(formatter)
             self.logger.addHandler(file_handler)
             file_handler.close()
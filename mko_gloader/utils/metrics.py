@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from .logger import Logger
+
+# Upper bounds of the request latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROMETHEUS_PREFIX = 'gloader'
+
+
+class Metrics:
+    """
+    Thread-safe performance metrics of a run.
+
+    Covers Google Drive requests per API method with a latency histogram, counters such as
+    transferred files and bytes, retries and throttles, and the wall time of the run phases.
+    Phases may overlap, e.g. uploads start while the trees are still being compared.
+    The metrics are exported as JSON and as a Prometheus textfile.
+
+    Usage:
+    metrics = Metrics.shared()
+    metrics.observe('drive.files.list', 0.2)
+    metrics.add('bytes_uploaded', 1024)
+    with metrics.phase('local_scan'):
+        ...
+    metrics.export(configuration)
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = Logger()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {}
+        self._phases = {}
+
+    @classmethod
+    def shared(cls):
+        """
+        Get the metrics shared by the whole process.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def reset(self):
+        """
+        Drop everything recorded so far and start a new run, e.g. for every burst pushed by watch.
+        """
+        with self._lock:
+            self.started = time.time()
+            self._calls = {}
+            self._counters = {}
+            self._phases = {}
+
+    def observe(self, method, seconds, failed=False):
+        """
+        Record a request.
+
+        Parameters:
+        - method: API method, e.g. 'drive.files.list'.
+        - seconds: Time the request took.
+        - failed: Boolean indicating whether the request raised an error.
+        """
+        with self._lock:
+            call = self._calls.get(method)
+            if call is None:
+                call = self._calls[method] = {'count': 0, 'errors': 0, 'seconds': 0.0,
+                                              'buckets': [0] * len(LATENCY_BUCKETS)}
+            call['count'] += 1
+            call['errors'] += bool(failed)
+            call['seconds'] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    call['buckets'][i] += 1
+                    break
+
+    def add(self, name, value=1):
+        """
+        Increase a counter, e.g. 'files_uploaded' or 'retries'.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_time(self, phase, seconds):
+        """
+        Add wall time to a phase, e.g. 'local_scan', 'remote_listing', 'diff' or 'transfer'.
+        """
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measure the wall time of a block as part of a phase.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.monotonic() - started)
+
+    def to_dict(self):
+        """
+        Get the metrics as a dictionary, the histogram buckets are cumulative like in Prometheus.
+        """
+        with self._lock:
+            calls = {}
+            for method, call in self._calls.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS, call['buckets']):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                buckets['+Inf'] = call['count']
+                calls[method] = {'count': call['count'], 'errors': call['errors'],
+                                 'seconds': call['seconds'], 'buckets': buckets}
+            return {
+                'started': self.started,
+                'run_seconds': time.time() - self.started,
+                'api_calls': calls,
+                'counters': dict(self._counters),
+                'phases': dict(self._phases)
+            }
+
+    def to_prometheus(self):
+        """
+        Get the metrics in the Prometheus text exposition format.
+        """
+        data = self.to_dict()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_run_duration_seconds Wall time of the run.",
+            f"# TYPE {p}_run_duration_seconds gauge",
+            f"{p}_run_duration_seconds {data['run_seconds']:.6f}",
+            f"# HELP {p}_last_run_timestamp_seconds Time the run started.",
+            f"# TYPE {p}_last_run_timestamp_seconds gauge",
+            f"{p}_last_run_timestamp_seconds {data['started']:.3f}",
+            f"# HELP {p}_phase_duration_seconds Wall time of a phase of the run.",
+            f"# TYPE {p}_phase_duration_seconds gauge",
+        ]
+        lines += [f'{p}_phase_duration_seconds{{phase="{name}"}} {seconds:.6f}'
+                  for name, seconds in sorted(data['phases'].items())]
+        for name, value in sorted(data['counters'].items()):
+            lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {value}"]
+
+        lines += [f"# HELP {p}_api_errors_total Google Drive requests failed per API method.",
+                  f"# TYPE {p}_api_errors_total counter"]
+        lines += [f'{p}_api_errors_total{{method="{method}"}} {call["errors"]}'
+                  for method, call in sorted(data['api_calls'].items())]
+        lines += [f"# HELP {p}_api_request_duration_seconds Latency of the Google Drive requests per API method.",
+                  f"# TYPE {p}_api_request_duration_seconds histogram"]
+        for method, call in sorted(data['api_calls'].items()):
+            lines += [f'{p}_api_request_duration_seconds_bucket{{method="{method}",le="{bound}"}} {count}'
+                      for bound, count in call['buckets'].items()]
+            lines.append(f'{p}_api_request_duration_seconds_sum{{method="{method}"}} {call["seconds"]:.6f}')
+            lines.append(f'{p}_api_request_duration_seconds_count{{method="{method}"}} {call["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write(path, content):
+        # Readers such as the node exporter textfile collector never see a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    def export(self, configuration):
+        """
+        Write the metrics to the files set by the 'json_path' and 'prometheus_path' settings.
+
+        Parameters:
+        - configuration: ConfigHelper with the Metrics settings.
+        """
+        try:
+            if configuration.metrics_json_path:
+                self._write(configuration.metrics_json_path, json.dumps(self.to_dict(), indent=2))
+            if configuration.metrics_prometheus_path:
+                self._write(configuration.metrics_prometheus_path, self.to_prometheus())
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in export: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
@@ -0,0 +1,91 @@
+import re
+
+
+class PathFilter:
+    """
+    Selects the paths to synchronize using gitignore-style patterns.
+
+    Patterns without a slash match a name at any depth, e.g. 'node_modules' or '*.tmp'.
+    Patterns with a slash are relative to the synchronized folder, e.g. '/build' or 'docs/*.pdf'.
+    A trailing slash matches directories only, '**' matches any number of directories.
+    Include patterns, like gitignore patterns starting with '!', select paths excluded before them.
+    The last matching pattern wins. Excluded directories are pruned as a whole,
+    so nothing inside them can be included back.
+
+    Usage:
+    path_filter = PathFilter(exclude=['.git/', 'node_modules/', '*.tmp'], include=['keep.tmp'])
+    path_filter.is_excluded('/src/node_modules', is_dir=True)
+    """
+
+    def __init__(self, exclude=(), include=()):
+        """
+        Initialize PathFilter.
+
+        Parameters:
+        - exclude: Patterns of the paths to skip, patterns starting with '!' include paths back.
+        - include: Patterns of the paths to select even if excluded, applied after exclude.
+        """
+        self.patterns = [p.strip() for p in exclude or () if p.strip()]
+        self.patterns += ['!' + p.strip().lstrip('!') for p in include or () if p.strip()]
+        self._rules = [self._compile(pattern) for pattern in self.patterns if not pattern.startswith('#')]
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    @classmethod
+    def from_configuration(cls, configuration):
+        """
+        Create the filter from the 'exclude' and 'include' settings.
+        """
+        return cls(configuration.exclude_patterns, configuration.include_patterns)
+
+    @staticmethod
+    def _compile(pattern):
+        negate = pattern.startswith('!')
+        pattern = pattern[1:] if negate else pattern
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+
+        regex, i = [], 0
+        while i < len(pattern):
+            if pattern.startswith('**/', i):
+                regex.append('(?:.*/)?')
+                i += 3
+            elif pattern.startswith('**', i):
+                regex.append('.*')
+                i += 2
+            elif pattern[i] == '*':
+                regex.append('[^/]*')
+                i += 1
+            elif pattern[i] == '?':
+                regex.append('[^/]')
+                i += 1
+            elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+                end = pattern.index(']', i + 1)
+                chars = pattern[i + 1:end]
+                regex.append('[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']')
+                i = end + 1
+            else:
+                regex.append(re.escape(pattern[i]))
+                i += 1
+        prefix = '' if anchored else '(?:.*/)?'
+        return re.compile(prefix + ''.join(regex) + r'\Z'), dir_only, negate
+
+    def is_excluded(self, path, is_dir=False):
+        """
+        Check whether a path is excluded.
+
+        Parameters:
+        - path: Path relative to the synchronized folder, e.g. '/docs/file.txt'.
+        - is_dir: Boolean indicating whether the path is a directory.
+        """
+        if not self._rules:
+            return False
+        path = path.lstrip('/')
+        excluded = False
+        for regex, dir_only, negate in self._rules:
+            if excluded == negate and (is_dir or not dir_only) and regex.match(path):
+                excluded = not negate
+        return excluded
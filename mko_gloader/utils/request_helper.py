@@ -0,0 +1,281 @@
+import random
+import socket
+import ssl
+import threading
+import time
+from .logger import Logger
+from .metrics import Metrics
+
+# Server errors worth retrying, 429 is the rate limit
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# Reasons of the 403 errors Google Drive returns when the quota is exceeded
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+# The first backoff delay, doubled for every further attempt
+BASE_BACKOFF = 1.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of requests.
+
+    Tokens are added at a constant rate up to the burst size, every request takes one.
+    A rate of 0 disables the limit.
+
+    Usage:
+    bucket = TokenBucket(rate=10, burst=20)
+    bucket.acquire()
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Initialize TokenBucket.
+
+        Parameters:
+        - rate: Tokens added per second.
+        - burst: Largest number of tokens kept, defaults to one second worth of tokens.
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Take tokens, waiting until enough of them are available.
+
+        Parameters:
+        - tokens: Number of tokens to take, a batch of requests takes one per request.
+
+        Returns:
+        Seconds spent waiting.
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # Batches larger than the burst are let through once the bucket is full
+                needed = min(tokens, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RequestHelper:
+    """
+    Single path for the Google Drive requests, shared by all worker threads.
+
+    Requests are rate limited by a token bucket sized to the project quota. Requests failed
+    with a rate limit, a server or a network error are retried with jittered exponential backoff.
+    A rate limit error pauses every worker until the backoff is over, so the workers back off
+    together instead of each one hammering the quota.
+
+    Usage:
+    requests = RequestHelper.shared(configuration)
+    response = requests.execute(service.files().get(fileId=file_id))
+    status, done = requests.call(downloader.next_chunk)
+    print(requests.stats())
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, requests_per_second=0, burst=None, max_retries=5, max_backoff=64):
+        """
+        Initialize RequestHelper.
+
+        Parameters:
+        - requests_per_second: Rate limit of the requests, 0 disables it.
+        - burst: Number of requests allowed at once, defaults to one second worth of requests.
+        - max_retries: Attempts to resend a failed request.
+        - max_backoff: The longest backoff delay in seconds.
+        """
+        self.logger = Logger()
+        self.metrics = Metrics.shared()
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'retried': 0, 'throttled': 0, 'wait_seconds': 0.0}
+
+    @classmethod
+    def shared(cls, configuration):
+        """
+        Get the helper shared by the whole process, the quota belongs to the project, not to a helper.
+
+        Parameters:
+        - configuration: ConfigHelper used to create the helper on first call.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(configuration.requests_per_second, configuration.request_burst,
+                                  configuration.max_retries, configuration.max_backoff)
+            return cls._shared
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def stats(self):
+        """
+        Get the number of requests sent, retried and throttled and the seconds spent waiting.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    @staticmethod
+    def network_errors():
+        """
+        Get the errors of the connection rather than of the request, e.g. a DNS failure or a dropped socket.
+        """
+        # The Google client stack is imported on first request, it takes long to load
+        from google.auth.exceptions import TransportError
+        from httplib2 import HttpLib2Error
+        return ConnectionError, TimeoutError, ssl.SSLError, socket.gaierror, HttpLib2Error, TransportError
+
+    @staticmethod
+    def is_rate_limit(error):
+        """
+        Check whether an error means the quota is exceeded.
+        """
+        from googleapiclient.errors import HttpError
+        if not isinstance(error, HttpError):
+            return False
+        if error.resp.status == 429:
+            return True
+        if error.resp.status != 403:
+            return False
+        content = error.content
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+
+    @classmethod
+    def is_retryable(cls, error):
+        """
+        Check whether a failed request is worth sending again.
+        """
+        from googleapiclient.errors import HttpError
+        if isinstance(error, HttpError):
+            return error.resp.status in RETRYABLE_STATUSES or cls.is_rate_limit(error)
+        # Local errors such as a missing file are not, resending would fail the same way
+        return isinstance(error, cls.network_errors())
+
+    def _wait_for_turn(self, cost):
+        waited = 0.0
+        while True:
+            with self._lock:
+                pause = self._paused_until - time.monotonic()
+            if pause <= 0:
+                break
+            time.sleep(pause)
+            waited += pause
+        waited += self.bucket.acquire(cost)
+        if waited:
+            self._count('wait_seconds', waited)
+
+    def _backoff(self, attempt, error):
+        # Full jitter keeps the workers from retrying in lockstep
+        delay = random.uniform(0, min(self.max_backoff, BASE_BACKOFF * 2 ** attempt))
+        if self.is_rate_limit(error):
+            self._count('throttled')
+            self.metrics.add('throttles')
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        else:
+            time.sleep(delay)
+        self._count('retried')
+        self.metrics.add('retries')
+        self.logger.info(f"Request failed, retry {attempt + 1} of {self.max_retries} in {delay:.1f}s: {error}")
+
+    def call(self, send, cost=1, on_retry=None, method='request'):
+        """
+        Call a function sending a request, retrying it on retryable errors.
+
+        Parameters:
+        - send: Callable sending the request, e.g. the next_chunk method of an upload.
+        - cost: Number of requests sent by a call, e.g. the size of a batch.
+        - on_retry: Callable invoked before a failed request is retried.
+        - method: Name of the request in the metrics.
+
+        Returns:
+        The result of send.
+        """
+        from googleapiclient.errors import HttpError
+        retryable = (HttpError, OSError) + self.network_errors()
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_turn(cost)
+            self._count('requests', cost)
+            started = time.monotonic()
+            try:
+                result = send()
+            except retryable as e:
+                self.metrics.observe(method, time.monotonic() - started, failed=True)
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    raise
+                self._backoff(attempt, e)
+                if on_retry:
+                    on_retry()
+            else:
+                self.metrics.observe(method, time.monotonic() - started)
+                return result
+
+    def execute(self, request, cost=1):
+        """
+        Execute a request or a batch of requests, retrying it on retryable errors.
+
+        Parameters:
+        - request: HttpRequest or BatchHttpRequest.
+        - cost: Number of requests in a batch.
+
+        Returns:
+        The response of the request.
+        """
+        # A batch has no method of its own
+        return self.call(request.execute, cost, method=getattr(request, 'methodId', None) or 'batch')
+
+    def execute_batch(self, new_batch, requests, batch_limit=100):
+        """
+        Execute requests in batches, resending the requests failed with retryable errors.
+
+        Every request of a batch counts against the quota and fails on its own,
+        so rate limited requests are collected and sent again in a new batch after the backoff.
+
+        Parameters:
+        - new_batch: Callable creating a BatchHttpRequest from a callback.
+        - requests: Dictionary mapping request IDs to callables building the requests.
+        - batch_limit: Largest number of requests in a batch.
+
+        Returns:
+        Dictionary mapping the IDs of the requests that failed to their errors.
+        """
+        failed = {}
+        pending = list(requests)
+        for attempt in range(self.max_retries + 1):
+            errors = {}
+
+            def callback(request_id, response, exception):
+                if exception:
+                    errors[request_id] = exception
+
+            for i in range(0, len(pending), batch_limit):
+                batch = new_batch(callback)
+                for request_id in pending[i:i + batch_limit]:
+                    batch.add(requests[request_id](), request_id=request_id)
+                self.execute(batch, cost=len(pending[i:i + batch_limit]))
+
+            pending = [request_id for request_id, error in errors.items() if self.is_retryable(error)]
+            failed.update(errors)
+            if not pending or attempt == self.max_retries:
+                return failed
+            self._backoff(attempt, errors[pending[0]])
+            for request_id in pending:
+                del failed[request_id]
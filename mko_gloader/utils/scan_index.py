@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import traceback
+from collections import namedtuple
+from pathlib import Path
+from .logger import Logger
+from .config_helper import ConfigHelper
+
+INDEX_FOLDER_NAME = 'index'
+FLUSH_EVERY = 10000
+
+IndexEntry = namedtuple('IndexEntry', ['path', 'parent', 'name', 'is_dir', 'inode', 'size', 'mtime_ns', 'md5'])
+
+
+class ScanIndex:
+    """
+    An on-disk index of a local folder kept in SQLite between runs.
+
+    Every file and directory is stored by its path relative to the source folder,
+    together with the inode, size, modification time and a cached content hash.
+    Rows not seen during the last scan are dropped by finish().
+
+    Usage:
+    index = ScanIndex("/home/user/data")
+    index.begin_scan()
+    entry = index.get("/docs/file.txt")
+    index.put("/docs/file.txt", is_dir=False, stat=os.stat("/home/user/data/docs/file.txt"))
+    index.finish()
+    index.close()
+    """
+
+    def __init__(self, source_folder_path, index_folder_path: [str, os.PathLike] = None):
+        """
+        Open (or create) the index of the source folder.
+        """
+        self.configuration = ConfigHelper.shared()
+        self.logger = Logger()
+        try:
+            index_folder_path = Path(index_folder_path or Path(self.configuration.config_path, INDEX_FOLDER_NAME))
+            os.makedirs(index_folder_path, exist_ok=True)
+            digest = hashlib.sha1(os.path.abspath(source_folder_path).encode('utf-8')).hexdigest()[:16]
+            self.INDEX_PATH = Path(index_folder_path, f"{digest}.sqlite")
+
+            self.connection = sqlite3.connect(self.INDEX_PATH)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "path TEXT PRIMARY KEY, parent TEXT, name TEXT, is_dir INTEGER, "
+                "inode INTEGER, size INTEGER, mtime_ns INTEGER, md5 TEXT, scan_id INTEGER)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._pending = []
+            self.scan_id = None
+            self.begin_scan()
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in ScanIndex initialization: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+
+    def begin_scan(self, settings=None):
+        """
+        Start a new scan, entries not stored again before finish() will be dropped.
+
+        Parameters:
+        - settings: JSON serializable settings affecting the scan result, e.g. filter patterns.
+          All entries are dropped when they differ from the settings of the previous scan.
+        """
+        self.flush()
+        if settings is not None:
+            value = json.dumps(settings)
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+            if row is None or row[0] != value:
+                self.connection.execute("DELETE FROM entries")
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('settings', ?)", (value,))
+                self.connection.commit()
+        self.scan_id = self.connection.execute(
+            "SELECT COALESCE(MAX(scan_id), 0) + 1 FROM entries").fetchone()[0]
+
+    @staticmethod
+    def is_unchanged(entry, stat):
+        """
+        Check whether an index entry still describes the file behind the stat result.
+        """
+        return (entry is not None and entry.inode == stat.st_ino
+                and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns)
+
+    def get(self, path):
+        """
+        Get the entry stored for a path or None.
+        """
+        self.flush()
+        row = self.connection.execute(
+            "SELECT path, parent, name, is_dir, inode, size, mtime_ns, md5 FROM entries WHERE path = ?",
+            (path,)
+        ).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def list_children(self, path):
+        """
+        Get the entries stored for the direct children of a directory, keyed by name.
+        """
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT path, parent, name, is_dir, inode, size, mtime_ns, md5 FROM entries WHERE parent = ?",
+            (path,)
+        )
+        return {row[2]: IndexEntry(*row) for row in rows}
+
+    def put(self, path, is_dir, stat, md5=None):
+        """
+        Store an entry and mark it as seen by the current scan.
+
+        Parameters:
+        - path: Path relative to the source folder, '' for the folder itself.
+        - is_dir: Boolean indicating whether the entry is a directory.
+        - stat: os.stat_result of the entry.
+        - md5: Cached content hash, if known.
+        """
+        parent, name = (path.rsplit('/', 1) if path else (None, ''))
+        self._pending.append(
+            (path, parent, name, int(is_dir), stat.st_ino, stat.st_size, stat.st_mtime_ns, md5, self.scan_id))
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def commit(self):
+        """
+        Write buffered entries and commit them.
+        """
+        self.flush()
+        self.connection.commit()
+
+    def flush(self):
+        """
+        Write buffered entries to the database.
+        """
+        if self._pending:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def finish(self):
+        """
+        Drop entries that were not seen by the current scan and commit.
+        """
+        self.flush()
+        self.connection.execute("DELETE FROM entries WHERE scan_id != ?", (self.scan_id,))
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commit pending changes and close the database.
+        """
+        self.flush()
+        self.connection.commit()
+        self.connection.close()
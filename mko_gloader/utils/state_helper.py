@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+from pathlib import Path
+from .logger import Logger
+from .config_helper import ConfigHelper
+
+STATE_FOLDER_NAME = 'state'
+
+
+class StateHelper:
+    """
+    A utility class to persist small pieces of state between runs, such as remote tree snapshots.
+
+    States are stored as JSON files in the 'state' folder next to the configuration file
+    and are written atomically, so an interrupted run never leaves a broken file behind.
+
+    Usage:
+    state_helper = StateHelper()
+    state_helper.save('remote_tree', folder_id, {'page_token': token})
+    snapshot = state_helper.load('remote_tree', folder_id)
+    """
+
+    def __init__(self, state_folder_path: [str, os.PathLike] = None):
+        """
+        Initialize StateHelper with the folder to keep the states in.
+        """
+        self.configuration = ConfigHelper.shared()
+        self.logger = Logger()
+        self.STATE_FOLDER_PATH = Path(state_folder_path or Path(self.configuration.config_path, STATE_FOLDER_NAME))
+
+    def get_state_path(self, name, key):
+        """
+        Get the path of the file keeping the state.
+
+        Parameters:
+        - name: Kind of the state, e.g. 'remote_tree'.
+        - key: Any string identifying the state instance, e.g. a folder ID or a local path.
+        """
+        digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:16]
+        return Path(self.STATE_FOLDER_PATH, f"{name}_{digest}.json")
+
+    def load(self, name, key):
+        """
+        Load a state, returns None if it does not exist or can't be read.
+        """
+        state_path = self.get_state_path(name, key)
+        try:
+            if not state_path.is_file():
+                return None
+            with open(state_path, 'r', encoding='utf-8') as state_file:
+                state = json.load(state_file)
+            # Different keys may share the same digest prefix, make sure it's ours
+            if state.get('key') != str(key):
+                return None
+            return state.get('data')
+        except Exception as e:
+            self.logger.error(f"Error occurred in load state {state_path}: {e}")
+            self.logger.error(traceback.format_exc())
+            return None
+
+    def save(self, name, key, data):
+        """
+        Save a state, replacing the previous one.
+
+        Parameters:
+        - name: Kind of the state, e.g. 'remote_tree'.
+        - key: Any string identifying the state instance.
+        - data: JSON serializable data to store.
+        """
+        state_path = self.get_state_path(name, key)
+        try:
+            os.makedirs(self.STATE_FOLDER_PATH, exist_ok=True)
+            tmp_path = state_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as state_file:
+                json.dump({'key': str(key), 'data': data}, state_file)
+            os.replace(tmp_path, state_path)
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in save state {state_path}: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+
+    def drop(self, name, key):
+        """
+        Remove a state if it exists.
+        """
+        state_path = self.get_state_path(name, key)
+        if state_path.is_file():
+            os.remove(state_path)
+
+    def prune(self, name, max_age):
+        """
+        Remove states of a kind that were not updated for a while.
+
+        Parameters:
+        - name: Kind of the state, e.g. 'upload_session'.
+        - max_age: Age in seconds after which a state is removed.
+        """
+        if not self.STATE_FOLDER_PATH.is_dir():
+            return
+        expire_before = time.time() - max_age
+        for state_path in self.STATE_FOLDER_PATH.glob(f"{name}_*.json"):
+            try:
+                if state_path.stat().st_mtime < expire_before:
+                    os.remove(state_path)
+            except FileNotFoundError:
+                pass
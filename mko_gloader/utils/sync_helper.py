@@ -0,0 +1,249 @@
+from collections import namedtuple
+from .logger import Logger
+from .state_helper import StateHelper
+from .tree import Tree
+
+SYNC_BASE_STATE = 'sync_base'
+
+# Directions of a sync change
+PUSH = 'Push'
+PULL = 'Pull'
+CONFLICT = 'Conflict'
+
+# A single change found by the three-way comparison, kind is 'Additions', 'Deletions' or 'Modifications'
+SyncChange = namedtuple('SyncChange', ['direction', 'kind', 'path', 'drive_id', 'is_dir'])
+
+
+class SyncHelper:
+    """
+    A utility class for the three-way comparison of the local filesystem and Google Drive.
+
+    The state both sides agreed on after the last successful sync is kept as the base.
+    Comparing each side with the base tells which side changed, so a file deleted locally
+    is not downloaded again and a file added remotely is not deleted.
+    Paths changed on both sides in different ways are reported as conflicts and left untouched.
+
+    Usage:
+    sync_helper = SyncHelper()
+    base_tree = sync_helper.load_base(key)
+    for change in SyncHelper.iter_changes(base_tree, local_fs_tree, gdrive_tree):
+        ...
+    sync_helper.save_base(key, local_fs_tree, gdrive_tree, conflicts)
+    """
+
+    def __init__(self, state=None):
+        """
+        Initialize SyncHelper.
+
+        Parameters:
+        - state: StateHelper to keep the base in, a new one is created by default.
+        """
+        self.logger = Logger()
+        self.state = state or StateHelper()
+
+    def load_base(self, key):
+        """
+        Load the base saved by the last successful sync.
+
+        Parameters:
+        - key: String identifying the pair of synchronized folders.
+
+        Returns:
+        A Tree or None if the folders were never synchronized.
+        """
+        entries = self.state.load(SYNC_BASE_STATE, key)
+        if entries is None:
+            return None
+        base_tree = Tree()
+        base_tree.add([''], is_dir=True)
+        nodes = {'': base_tree.root}
+        # Entries are saved parents first
+        for path, is_dir, file_size, md5 in entries:
+            parent_path, name = path.rsplit('/', 1)
+            parent = nodes.get(parent_path)
+            if parent is not None:
+                nodes[path] = base_tree.add_child(parent, name, is_dir=is_dir, file_size=file_size, md5=md5)
+        return base_tree
+
+    def save_base(self, key, local_fs_tree, gdrive_tree, conflicts=(), base_tree=None):
+        """
+        Save the paths present with the same content on both sides as the new base.
+
+        Conflicting paths keep their previous base, so they are reported again until resolved.
+
+        Parameters:
+        - key: String identifying the pair of synchronized folders.
+        - local_fs_tree: Local filesystem tree reflecting the result of the sync.
+        - gdrive_tree: Google Drive tree reflecting the result of the sync.
+        - conflicts: SyncChange records of the conflicts left unresolved.
+        - base_tree: The previous base.
+        """
+        conflict_paths = {change.path for change in conflicts}
+        entries = []
+        stack = [(local_fs_tree.root, gdrive_tree.root, base_tree.root if base_tree else None, '')]
+        while stack:
+            local_node, remote_node, base_node, prefix = stack.pop()
+            names = set(local_node.children) & set(remote_node.children)
+            if base_node is not None:
+                names.update(name for name in base_node.children if f"{prefix}/{name}" in conflict_paths)
+            for name in names:
+                path = f"{prefix}/{name}"
+                base_child = base_node.children.get(name) if base_node else None
+                if path in conflict_paths:
+                    if base_child is not None:
+                        entries.extend(self._subtree_entries(base_child, path))
+                    continue
+                local_child, remote_child = local_node.children[name], remote_node.children[name]
+                if local_child.isDir and remote_child.isDir:
+                    entries.append((path, True, 0, None))
+                    stack.append((local_child, remote_child, base_child, path))
+                elif not local_child.isDir and not remote_child.isDir and not self._is_changed(
+                        remote_child, local_child, path):
+                    entries.append((path, False, int(remote_child.fileSize or 0),
+                                    remote_child.md5 or local_child.md5))
+        entries.sort(key=lambda entry: entry[0].count('/'))
+        self.state.save(SYNC_BASE_STATE, key, entries)
+
+    @staticmethod
+    def _subtree_entries(node, path):
+        entries = []
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            entries.append((path, bool(node.isDir), int(node.fileSize or 0), node.md5))
+            stack.extend((child, f"{path}/{name}") for name, child in node.children.items())
+        return entries
+
+    @staticmethod
+    def _is_changed(base_node, node, path, hash_func=None):
+        """
+        Check whether a node differs from its base, hash_func is only used to fill the node checksum.
+        """
+        if base_node.isDir or node.isDir:
+            return bool(base_node.isDir) != bool(node.isDir)
+        if int(base_node.fileSize or 0) != int(node.fileSize or 0):
+            return True
+        if base_node.md5 is None:
+            return False
+        if node.md5 is None and hash_func is not None:
+            node.md5 = hash_func(path)
+        return node.md5 is not None and node.md5 != base_node.md5
+
+    @classmethod
+    def _is_subtree_changed(cls, base_node, node, path, hash_func=None):
+        """
+        Check whether anything was added, removed or modified under a folder since the base.
+        """
+        stack = [(base_node, node, path)]
+        while stack:
+            base_node, node, path = stack.pop()
+            if base_node.children.keys() != node.children.keys():
+                return True
+            for name, child in node.children.items():
+                child_path = f"{path}/{name}"
+                if cls._is_changed(base_node.children[name], child, child_path, hash_func):
+                    return True
+                if child.isDir:
+                    stack.append((base_node.children[name], child, child_path))
+        return False
+
+    @classmethod
+    def iter_changes(cls, base_tree, local_fs_tree, gdrive_tree, hash_func=None):
+        """
+        Compare both sides with the base and yield what has to be done to bring them together.
+
+        Added or deleted folders are reported as a whole. Paths changed on a single side are
+        reported in the direction of the other side: 'Push' changes Google Drive, 'Pull' changes
+        the local filesystem. Paths changed on both sides, unless the result is the same,
+        and files replaced by folders or back are reported as 'Conflict'.
+
+        Parameters:
+        - base_tree: Tree returned by load_base or None if the folders were never synchronized.
+        - local_fs_tree: Local filesystem tree.
+        - gdrive_tree: Google Drive tree.
+        - hash_func: Callable returning the MD5 checksum of a local file by its path, enables checksum comparison.
+
+        Yields:
+        SyncChange records.
+        """
+        if not local_fs_tree.root or not gdrive_tree.root:
+            return
+        stack = [(base_tree.root if base_tree else None, local_fs_tree.root, gdrive_tree.root, '')]
+        while stack:
+            base_node, local_node, remote_node, prefix = stack.pop()
+            base_children = base_node.children if base_node else {}
+            local_children = local_node.children if local_node else {}
+            remote_children = remote_node.children if remote_node else {}
+            for name in set(base_children) | set(local_children) | set(remote_children):
+                path = f"{prefix}/{name}"
+                base, local, remote = base_children.get(name), local_children.get(name), remote_children.get(name)
+
+                if base is None:
+                    if remote is None:
+                        yield SyncChange(PUSH, "Additions", path, None, local.isDir)
+                    elif local is None:
+                        yield SyncChange(PULL, "Additions", path, remote.id, remote.isDir)
+                    elif local.isDir and remote.isDir:
+                        stack.append((None, local, remote, path))
+                    elif local.isDir or remote.isDir or Tree._is_modified(local, remote, path, hash_func):
+                        yield SyncChange(CONFLICT, "Modifications", path, remote.id, bool(local.isDir))
+                    continue
+
+                if local is None and remote is None:
+                    continue
+                if local is None:
+                    if remote.isDir and base.isDir and cls._is_subtree_changed(base, remote, path):
+                        yield SyncChange(CONFLICT, "Deletions", path, remote.id, True)
+                    elif cls._is_changed(base, remote, path):
+                        yield SyncChange(CONFLICT, "Deletions", path, remote.id, remote.isDir)
+                    else:
+                        yield SyncChange(PUSH, "Deletions", path, remote.id, remote.isDir)
+                    continue
+                if remote is None:
+                    if local.isDir and base.isDir and cls._is_subtree_changed(base, local, path, hash_func):
+                        yield SyncChange(CONFLICT, "Deletions", path, None, True)
+                    elif cls._is_changed(base, local, path, hash_func):
+                        yield SyncChange(CONFLICT, "Deletions", path, None, local.isDir)
+                    else:
+                        yield SyncChange(PULL, "Deletions", path, None, local.isDir)
+                    continue
+
+                if local.isDir and remote.isDir and base.isDir:
+                    stack.append((base, local, remote, path))
+                    continue
+                if bool(local.isDir) != bool(remote.isDir) or bool(local.isDir) != bool(base.isDir):
+                    # A file replaced by a folder or back
+                    yield SyncChange(CONFLICT, "Modifications", path, remote.id, bool(local.isDir))
+                    continue
+
+                local_changed = cls._is_changed(base, local, path, hash_func)
+                remote_changed = cls._is_changed(base, remote, path)
+                if local_changed and remote_changed:
+                    if Tree._is_modified(local, remote, path, hash_func):
+                        yield SyncChange(CONFLICT, "Modifications", path, remote.id, False)
+                elif local_changed:
+                    yield SyncChange(PUSH, "Modifications", path, remote.id, False)
+                elif remote_changed:
+                    yield SyncChange(PULL, "Modifications", path, remote.id, False)
+
+    @staticmethod
+    def copy_node(source_tree, target_tree, path):
+        """
+        Copy a node with its descendants from one tree to another, replacing the existing one.
+
+        Parameters:
+        - source_tree: Tree to copy from.
+        - target_tree: Tree to copy to, the parent of the node must exist in it.
+        - path: Path of the node starting with '/'.
+        """
+        names = path.strip('/').split('/')
+        source_node, nodes_traversed = source_tree.get_node(names)
+        target_parent, parent_traversed = target_tree.get_node(names[:-1])
+        if nodes_traversed < len(names) or parent_traversed < len(names) - 1:
+            return
+        target_tree.remove(names)
+        stack = [(source_node, target_parent)]
+        while stack:
+            node, parent = stack.pop()
+            copy = target_tree.add_child(parent, node.value, node.id, node.isDir, node.fileSize, node.md5)
+            stack.extend((child, copy) for child in node.children.values())
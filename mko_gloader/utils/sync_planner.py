@@ -0,0 +1,122 @@
+import time
+from .sync_helper import SyncHelper, PULL
+from .metrics import Metrics
+from .tree import Difference
+
+CHANGE_KINDS = ("Additions", "Modifications", "Deletions")
+
+
+class SyncPlanner:
+    """
+    Keeps the trees and the change sets of a single operation, so that fetch, pull and push
+    share one local scan and one Google Drive listing.
+
+    Change sets are computed on first use: 'local' lists the local changes to apply to Google Drive,
+    'server' lists the Google Drive changes to apply locally. Completed transfers are dropped from
+    the change sets and reflected in the trees.
+
+    Usage:
+    planner = SyncPlanner(gloader_instance.fetch_trees)
+    changes_in_local = planner.changes('local')
+    for change in planner.iter_changes('local'):
+        ...
+    planner.complete(PUSH, ['/docs/file.txt'])
+    """
+
+    def __init__(self, fetch_trees):
+        """
+        Initialize SyncPlanner.
+
+        Parameters:
+        - fetch_trees: Callable returning the Google Drive tree, the local filesystem tree
+          and the hash function to compare them with.
+        """
+        self._fetch_trees = fetch_trees
+        self.metrics = Metrics.shared()
+        self._trees = None
+        self._changes = {}
+
+    def reset(self, keep_trees=False):
+        """
+        Forget the cached change sets and, unless keep_trees is set, the trees.
+        """
+        self._changes = {}
+        if not keep_trees:
+            self._trees = None
+
+    def trees(self):
+        """
+        Get the Google Drive tree, the local filesystem tree and the hash function, fetching them once.
+        """
+        if self._trees is None:
+            self._trees = self._fetch_trees()
+        return self._trees
+
+    def iter_changes(self, side):
+        """
+        Yield the changes of a side as Difference records.
+
+        The first call compares the trees while yielding, so the caller may act on every change
+        before the comparison is over, the change set is cached once the generator is exhausted.
+
+        Parameters:
+        - side: 'local' or 'server'.
+        """
+        if side in self._changes:
+            for kind, changes in self._changes[side].items():
+                for change in list(changes):
+                    yield Difference(kind, *change)
+            return
+
+        gdrive_tree, local_fs_tree, hash_func = self.trees()
+        tree1, tree2 = (local_fs_tree, gdrive_tree) if side == 'local' else (gdrive_tree, local_fs_tree)
+        changes = {kind: [] for kind in CHANGE_KINDS}
+        # Only the time spent comparing counts, not the time the caller spends on every change
+        started = time.monotonic()
+        for change in tree1.iter_differences(tree2, hash_func, self_is_local=side == 'local'):
+            changes[change.kind].append((change.path, change.drive_id, change.is_dir))
+            self.metrics.add_time('diff', time.monotonic() - started)
+            yield change
+            started = time.monotonic()
+        self.metrics.add_time('diff', time.monotonic() - started)
+        self._changes[side] = changes
+
+    def changes(self, side):
+        """
+        Get the changes of a side as a dictionary of lists, like Tree.find_difference_path.
+
+        Parameters:
+        - side: 'local' or 'server'.
+        """
+        for _ in self.iter_changes(side):
+            pass
+        return self._changes[side]
+
+    def complete(self, direction, paths):
+        """
+        Record transfers that completed successfully.
+
+        The paths are dropped from every cached change set. Pulled paths are also copied
+        from the Google Drive tree to the local filesystem tree, or removed from it if they
+        no longer exist remotely. Pushed paths are kept up to date in the Google Drive tree
+        by TransferHelper and GoogleDriveHelper.
+
+        Parameters:
+        - direction: PUSH or PULL.
+        - paths: Paths of the completed changes.
+        """
+        paths = set(paths)
+        if not paths:
+            return
+        for changes in self._changes.values():
+            for kind in CHANGE_KINDS:
+                changes[kind] = [change for change in changes[kind] if change[0] not in paths]
+
+        if direction == PULL and self._trees is not None:
+            gdrive_tree, local_fs_tree, _ = self._trees
+            for path in paths:
+                names = path.strip('/').split('/')
+                if gdrive_tree.get_node(names)[1] == len(names):
+                    SyncHelper.copy_node(gdrive_tree, local_fs_tree, path)
+                else:
+                    local_fs_tree.remove(names)
@@ -0,0 +1,327 @@
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .logger import Logger
+from .config_helper import ConfigHelper
+from .functions import human_bytes
+from .filesystem_helper import DOWNLOAD_PART_SUFFIX
+from .path_filter import PathFilter
+from .metrics import Metrics
+
+UploadJob = namedtuple('UploadJob', ['path', 'parent_id', 'size', 'file_id'], defaults=[None])
+DownloadJob = namedtuple('DownloadJob', ['path', 'file_id', 'size', 'md5'], defaults=[None])
+
+
+class TransferStats:
+    """
+    Thread-safe counters of transferred files and bytes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, size):
+        with self._lock:
+            self.files += 1
+            self.bytes += int(size or 0)
+
+    @staticmethod
+    def rate(size, elapsed):
+        return f"{human_bytes(int(size or 0) / max(elapsed, 1e-6))}/s"
+
+    def summary(self, action):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return (f"{action} {self.files} files ({human_bytes(self.bytes)}) in {elapsed:.1f}s, "
+                f"{self.rate(self.bytes, elapsed)}")
+
+
+class TransferHelper:
+    """
+    A utility class to transfer files between the local filesystem and Google Drive
+    using a bounded pool of worker threads.
+
+    Usage:
+    transfer_helper = TransferHelper(gdrive_helper)
+    jobs = transfer_helper.plan_uploads(gdrive_tree, ["/docs", "/file.txt"])
+    transfer_helper.upload(gdrive_tree, jobs)
+    jobs = transfer_helper.plan_downloads(gdrive_tree, changes_in_server["Additions"])
+    transfer_helper.download(jobs)
+    """
+
+    def __init__(self, gdrive, upload_workers: int = None, download_workers: int = None):
+        """
+        Initialize TransferHelper.
+
+        Parameters:
+        - gdrive: GoogleDriveHelper instance, its service is created per worker thread.
+        - upload_workers: Maximum number of files uploaded at once, taken from configuration by default.
+        - download_workers: Maximum number of files downloaded at once, taken from configuration by default.
+        """
+        self.configuration = ConfigHelper.shared()
+        self.logger = Logger()
+        self.gdrive = gdrive
+        self.upload_workers = max(1, upload_workers or self.configuration.upload_workers or 1)
+        self.download_workers = max(1, download_workers or self.configuration.download_workers or 1)
+        self.path_filter = PathFilter.from_configuration(self.configuration)
+        self.metrics = Metrics.shared()
+
+    def create_remote_folders(self, gdrive_tree, folders):
+        """
+        Create missing Google Drive folders and add them to the tree.
+
+        IDs for all folders are reserved up front, then every depth level is created
+        with batch requests, so the number of round trips depends on the depth only.
+
+        Parameters:
+        - gdrive_tree: Google Drive tree of the destination folder.
+        - folders: Tuples of folder names starting from the tree root, parents before children.
+
+        Returns:
+        A dictionary of created folder IDs keyed by their names tuple.
+        """
+        created = dict(zip(folders, self.gdrive.generate_ids(len(folders)))) if folders else {}
+        by_depth = defaultdict(list)
+        for names in folders:
+            by_depth[len(names)].append(names)
+
+        for depth in sorted(by_depth):
+            level = []
+            for names in by_depth[depth]:
+                parent_id = created.get(names[:-1]) or gdrive_tree.get_node(list(names[:-1]))[0].id
+                level.append((created[names], names[-1], parent_id))
+            self.gdrive.create_folders(level)
+            for names in by_depth[depth]:
+                gdrive_tree.add([gdrive_tree.root.value] + list(names), created[names], is_dir=True)
+        return created
+
+    def plan_uploads(self, gdrive_tree, paths):
+        """
+        Create every folder needed by the upload and list the files to upload.
+
+        Folders are created before any file is uploaded, so file uploads only depend on known folder IDs.
+
+        Parameters:
+        - gdrive_tree: Google Drive tree of the destination folder.
+        - paths: Paths relative to the local source folder, files or directories.
+
+        Returns:
+        A list of UploadJob.
+        """
+        try:
+            source = self.gdrive.local_filesystem_folder_path
+            # Folders missing in Google Drive, keys are kept in insertion order, parents first
+            missing = {}
+            files = []
+
+            def require_folder(names):
+                for i in range(1, len(names) + 1):
+                    if names[:i] not in missing and gdrive_tree.get_node(list(names[:i]))[1] < i:
+                        missing[names[:i]] = None
+
+            for path in paths:
+                names = tuple(path.strip('/').split('/'))
+                if not os.path.isdir(source + path):
+                    require_folder(names[:-1])
+                    files.append((path, names[:-1]))
+                    continue
+
+                for dir_path, dir_names, file_names in os.walk(source + path):
+                    relative = dir_path[len(source):].replace(os.sep, '/')
+                    folder_names = tuple(relative.strip('/').split('/'))
+                    require_folder(folder_names)
+                    # Excluded directories are removed in place, so os.walk does not enter them
+                    dir_names[:] = [name for name in dir_names
+                                    if not self.path_filter.is_excluded(f"{relative}/{name}", True)]
+                    files.extend((f"{relative}/{file_name}", folder_names) for file_name in file_names
+                                 if not file_name.endswith(DOWNLOAD_PART_SUFFIX)
+                                 and not self.path_filter.is_excluded(f"{relative}/{file_name}"))
+
+            created = self.create_remote_folders(gdrive_tree, list(missing))
+            jobs = []
+            for path, folder_names in files:
+                folder_id = created.get(folder_names) or gdrive_tree.get_node(list(folder_names))[0].id
+                jobs.append(UploadJob(path, folder_id, os.path.getsize(source + path)))
+            return jobs
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in plan_uploads: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+
+    def stream_uploads(self, gdrive_tree, changes, deferred):
+        """
+        Turn differences between the local and the Google Drive tree into upload jobs as they are found.
+
+        Modified files and new files placed in existing Google Drive folders are yielded at once.
+        New folders, and files that need them, are appended to deferred, so that their folders
+        can be created together by plan_uploads once the comparison is over.
+
+        Parameters:
+        - gdrive_tree: Google Drive tree of the destination folder, it must not be modified meanwhile.
+        - changes: Iterable of Difference records of kind 'Additions' or 'Modifications'.
+        - deferred: List receiving the paths left for plan_uploads.
+
+        Yields:
+        UploadJob for every file that can be uploaded right away.
+        """
+        source = self.gdrive.local_filesystem_folder_path
+        for change in changes:
+            if change.is_dir:
+                if change.kind == "Additions":
+                    deferred.append(change.path)
+                continue
+            if change.kind == "Modifications":
+                yield UploadJob(change.path, None, os.path.getsize(source + change.path), change.drive_id)
+                continue
+            folder_names = change.path.strip('/').split('/')[:-1]
+            folder_node, nodes_traversed = gdrive_tree.get_node(folder_names)
+            if nodes_traversed < len(folder_names):
+                deferred.append(change.path)
+            else:
+                yield UploadJob(change.path, folder_node.id, os.path.getsize(source + change.path))
+
+    def upload(self, gdrive_tree, jobs):
+        """
+        Upload files concurrently and add them to the Google Drive tree, or update the existing nodes.
+
+        Jobs may come from a generator, every job is started as soon as it is produced
+        and the tree is only updated once the generator is exhausted.
+
+        Parameters:
+        - gdrive_tree: Google Drive tree of the destination folder.
+        - jobs: Iterable of UploadJob, e.g. returned by plan_uploads.
+        """
+        stats = TransferStats()
+        errors = []
+        self.gdrive.prune_upload_sessions()
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            futures = {}
+            for job in jobs:
+                futures[executor.submit(self.gdrive.upload_file_metadata, job.path, job.parent_id, job.file_id)] = job
+            if not futures:
+                return
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    uploaded = future.result()
+                except Exception as e:
+                    errors.append((job.path, e))
+                    continue
+                stats.add(job.size)
+                self.metrics.add('files_uploaded')
+                self.metrics.add('bytes_uploaded', int(job.size or 0))
+                path = [gdrive_tree.root.value] + job.path.strip('/').split('/')
+                # The checksum keeps the file from looking modified in 'md5' compare mode
+                md5 = uploaded.get('md5Checksum')
+                if job.file_id:
+                    node, _ = gdrive_tree.get_node(path[1:])
+                    node.fileSize, node.md5 = job.size, md5
+                else:
+                    gdrive_tree.add(path, uploaded['id'], is_dir=False, file_size=job.size, md5=md5)
+
+        self.metrics.add_time('transfer', time.monotonic() - stats.started)
+        if errors:
+            self.metrics.add('failed_uploads', len(errors))
+        print(stats.summary("Uploaded"))
+        self.logger.info(stats.summary("Uploaded"))
+        if errors:
+            for path, error in errors:
+                self.logger.error(f"Error occurred in upload of {path}: {error}")
+            raise RuntimeError(f"{len(errors)} of {len(futures)} uploads failed, first error: {errors[0][1]}")
+
+    def plan_downloads(self, gdrive_tree, changes):
+        """
+        Create every local directory needed by the download and list the files to download.
+
+        Folder content is taken from the Google Drive tree, so no extra listing is required.
+
+        Parameters:
+        - gdrive_tree: Google Drive tree of the destination folder.
+        - changes: Tuples (path, drive_id, is_dir) as returned by Tree.find_difference_path.
+
+        Returns:
+        A list of DownloadJob.
+        """
+        try:
+            source = self.gdrive.local_filesystem_folder_path
+            jobs = []
+            for path, drive_id, is_dir in changes:
+                node, _ = gdrive_tree.get_node(path.strip('/').split('/'))
+                if not is_dir:
+                    if node.id == drive_id:
+                        jobs.append(DownloadJob(path, drive_id, node.fileSize, node.md5))
+                    else:
+                        # Unknown size, not checked after the download
+                        jobs.append(DownloadJob(path, drive_id, None))
+                    continue
+
+                stack = [(path, node)]
+                while stack:
+                    folder_path, folder_node = stack.pop()
+                    os.makedirs(source + folder_path, exist_ok=True)
+                    for name, child in folder_node.children.items():
+                        if child.isDir:
+                            stack.append((f"{folder_path}/{name}", child))
+                        else:
+                            jobs.append(DownloadJob(f"{folder_path}/{name}", child.id, child.fileSize, child.md5))
+            return jobs
+        except Exception as e:
+            # Log the error using the logger
+            self.logger.error(f"Error occurred in plan_downloads: {e}")
+            # Optionally, log the full traceback for detailed error information
+            self.logger.error(traceback.format_exc())
+            # Raise the exception again to notify the caller about the error
+            raise e
+
+    def _download_job(self, job):
+        started = time.monotonic()
+        self.gdrive.download_file(job.path, job.file_id, job.size, job.md5)
+        elapsed = time.monotonic() - started
+        print(f"{job.path}: {human_bytes(int(job.size or 0))} in {elapsed:.1f}s, "
+              f"{TransferStats.rate(job.size, elapsed)}")
+
+    def download(self, jobs):
+        """
+        Download files concurrently into their final locations.
+
+        Jobs may come from a generator, every job is started as soon as it is produced.
+
+        Parameters:
+        - jobs: Iterable of DownloadJob, e.g. returned by plan_downloads.
+        """
+        stats = TransferStats()
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            futures = {}
+            for job in jobs:
+                futures[executor.submit(self._download_job, job)] = job
+            if not futures:
+                return
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append((job.path, e))
+                    continue
+                stats.add(job.size)
+                self.metrics.add('files_downloaded')
+                self.metrics.add('bytes_downloaded', int(job.size or 0))
+
+        self.metrics.add_time('transfer', time.monotonic() - stats.started)
+        if errors:
+            self.metrics.add('failed_downloads', len(errors))
+        print(stats.summary("Downloaded"))
+        self.logger.info(stats.summary("Downloaded"))
+        if errors:
+            for path, error in errors:
+                self.logger.error(f"Error occurred in download of {path}: {error}")
+            raise RuntimeError(f"{len(errors)} of {len(futures)} downloads failed, first error: {errors[0][1]}")
@@ -0,0 +1,102 @@
+import threading
+import weakref
+
+_discovery_lock = threading.Lock()
+_discovery_document = None
+
+
+def drive_discovery_document():
+    """
+    Get the Google Drive v3 discovery document bundled with googleapiclient.
+
+    The document is read once per process and nothing is requested over the network.
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            _discovery_document = get_static_doc('drive', 'v3')
+        return _discovery_document
+
+
+class _Lease:
+    """
+    Service borrowed by a thread, given back to the pool when the thread ends.
+    """
+    __slots__ = ('service', '__weakref__')
+
+    def __init__(self, service):
+        self.service = service
+
+
+class TransportPool:
+    """
+    Pool of Google Drive services, each with its own authorized keep-alive HTTP connection.
+
+    An httplib2 connection can't be shared across threads, so every thread borrows a service
+    on first use and keeps it until it ends. The service is then given back to the pool, so
+    the threads of the next listing or transfer reuse the open TCP/TLS connections instead
+    of opening new ones.
+
+    Usage:
+    transport = TransportPool(credentials, pool_size=16)
+    service = transport.service()
+    """
+
+    def __init__(self, credentials, pool_size=16, timeout=120):
+        """
+        Initialize TransportPool.
+
+        Parameters:
+        - credentials: Credentials authorizing the requests, shared by all connections.
+        - pool_size: Largest number of idle services kept for reuse.
+        - timeout: Socket timeout of the connections in seconds.
+        """
+        self.credentials = credentials
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.created = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+
+    def _new_service(self):
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+        http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+        return build_from_document(drive_discovery_document(), http=http)
+
+    def _release(self, service):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(service)
+                return
+        service.close()
+
+    def service(self):
+        """
+        Get the Google Drive service of the calling thread, borrowing one from the pool on first call.
+        """
+        lease = getattr(self._thread_local, 'lease', None)
+        if lease is None:
+            with self._lock:
+                # The most recently used connection is the most likely to be still open
+                service = self._idle.pop() if self._idle else None
+            if service is None:
+                service = self._new_service()
+                with self._lock:
+                    self.created += 1
+            lease = self._thread_local.lease = _Lease(service)
+            # Thread-local data is dropped when its thread ends
+            weakref.finalize(lease, self._release, service)
+        return lease.service
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for service in idle:
+            service.close()
@@ -1,8 +1,18 @@
-import os
+import sys
+from collections import namedtuple
+from types import MappingProxyType
+
+# Shared by every node without children, replaced with a dict when the first child is added
+NO_CHILDREN = MappingProxyType({})
+
+# A single difference between two trees, kind is 'Additions', 'Deletions' or 'Modifications'
+Difference = namedtuple('Difference', ['kind', 'path', 'drive_id', 'is_dir'])
 
 
 class TreeNode:
-    def __init__(self, value, drive_id=None, is_dir=None, file_size=0):
+    __slots__ = ('value', 'children', 'id', 'isDir', 'fileSize', 'md5', 'parent')
+
+    def __init__(self, value, drive_id=None, is_dir=None, file_size=0, md5=None, parent=None):
         """
         Initialize a TreeNode.
 
@@ -10,12 +20,18 @@ class TreeNode:
         - value: The value of the node.
         - drive_id: Identifier for the drive associated with the node.
         - is_dir: Boolean indicating whether the node represents a directory.
+        - file_size: Size of the file in bytes.
+        - md5: MD5 checksum of the file content, if known.
+        - parent: The parent node, None for the root.
         """
-        self.value = value
-        self.children = {}
+        # Names repeat a lot across large trees, interning keeps a single copy of each
+        self.value = sys.intern(value) if type(value) is str else value
+        self.children = NO_CHILDREN
         self.id = drive_id
         self.isDir = is_dir
         self.fileSize = file_size
+        self.md5 = md5
+        self.parent = parent
 
 
 class Tree:
@@ -24,8 +40,10 @@ class Tree:
         Initialize a Tree.
         """
         self.root = None
+        # Nodes keyed by their drive ID, kept up to date by add and remove
+        self.nodes_by_id = {}
 
-    def add(self, path, drive_id=None, is_dir=None, file_size=0):
+    def add(self, path, drive_id=None, is_dir=None, file_size=0, md5=None):
         """
         Add a node to the tree based on the given path.
 
@@ -33,32 +51,40 @@ class Tree:
         - path: List representing the path to the node.
         - drive_id: Identifier for the drive associated with the node.
         - is_dir: Boolean indicating whether the node represents a directory.
+        - file_size: Size of the file in bytes.
+        - md5: MD5 checksum of the file content, if known.
         """
         if not self.root:
-            self.root = TreeNode(path[0], drive_id, is_dir, file_size)
-        else:
-            self._add_recursive(self.root, path[1:], drive_id, is_dir, file_size)
+            self.root = TreeNode(path[0], drive_id, is_dir, file_size, md5)
+            self._register(self.root)
+            return
+        node = self.root
+        for value in path[1:]:
+            node = self.add_child(node, value, drive_id, is_dir, file_size, md5)
 
-    def _add_recursive(self, node, path, drive_id, is_dir=None, file_size=0):
+    def add_child(self, parent_node, value, drive_id=None, is_dir=None, file_size=0, md5=None):
         """
-        Recursively add a node to the tree.
+        Add a node directly under a known parent node, the existing child is kept if the name is taken.
 
         Parameters:
-        - node: The current node being processed.
-        - path: Remaining path to traverse.
+        - parent_node: The node to add the child to.
+        - value: The value of the child node.
         - drive_id: Identifier for the drive associated with the node.
         - is_dir: Boolean indicating whether the node represents a directory.
-        """
-        if len(path) == 0:
-            return
+        - file_size: Size of the file in bytes.
+        - md5: MD5 checksum of the file content, if known.
 
-        current_value = path[0]
-
-        if current_value in node.children:
-            self._add_recursive(node.children[current_value], path[1:], drive_id, is_dir, file_size)
-        else:
-            node.children[current_value] = TreeNode(current_value, drive_id, is_dir, file_size)
-            self._add_recursive(node.children[current_value], path[1:], drive_id, is_dir, file_size)
+        Returns:
+        The child node.
+        """
+        child = parent_node.children.get(value)
+        if child is None:
+            if parent_node.children is NO_CHILDREN:
+                parent_node.children = {}
+            child = TreeNode(value, drive_id, is_dir, file_size, md5, parent=parent_node)
+            parent_node.children[child.value] = child
+            self._register(child)
+        return child
 
     def remove(self, path):
         """
@@ -85,72 +111,138 @@ class Tree:
 
         if current_value in node.children:
             if len(path) == 1:
-                del node.children[current_value]
+                self._detach(node.children[current_value])
             else:
                 self._remove_recursive(node.children[current_value], path[1:])
         else:
             pass  # Value not found in the children, do nothing
 
-    def find_difference_path(self, tree2):
+    def remove_by_id(self, file_id):
+        """
+        Remove a node and its descendants from the tree by drive ID.
+
+        Parameters:
+        - file_id: Drive ID of the node to be removed.
+
+        Returns:
+        The removed node or None if the ID is not in the tree.
+        """
+        node = self.nodes_by_id.get(file_id)
+        if node is None or node.parent is None:
+            return None
+        self._detach(node)
+        return node
+
+    def _register(self, node):
+        """
+        Add a node to the ID index.
+        """
+        if node.id:
+            self.nodes_by_id[node.id] = node
+
+    def _detach(self, node):
+        """
+        Unlink a node from its parent and drop it with its descendants from the ID index.
+        """
+        if node.parent is not None and node.parent.children.get(node.value) is node:
+            del node.parent.children[node.value]
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.id and self.nodes_by_id.get(current.id) is current:
+                del self.nodes_by_id[current.id]
+            stack.extend(current.children.values())
+
+    def find_difference_path(self, tree2, hash_func=None, self_is_local=True):
         """
         Compare two trees and find the differences in node paths between them.
 
         Parameters:
         - tree2: The second tree to compare with.
+        - hash_func: Callable returning the MD5 checksum of a local file by its path, enables checksum comparison.
+        - self_is_local: Boolean indicating whether this tree is the local one, the other is Google Drive.
 
         Returns:
-        A dictionary containing lists of additions and deletions.
+        A dictionary containing lists of additions, deletions and modifications
+        as tuples (path, drive_id, is_dir).
         """
         changes_dic = {"Additions": [], "Deletions": [], "Modifications": []}
+        for change in self.iter_differences(tree2, hash_func, self_is_local):
+            changes_dic[change.kind].append((change.path, change.drive_id, change.is_dir))
+        return changes_dic
 
-        def compare_and_print_paths(node1, node2, current_path):
-            """
-            Helper function to recursively compare nodes in two trees.
-
-            Parameters:
-            - node1: Current node in the first tree.
-            - node2: Current node in the second tree.
-            - current_path: Current path being traversed.
-            """
-            keys1 = set(node1.children.keys())
-            keys2 = set(node2.children.keys())
-
-            common_keys = keys1.intersection(keys2)
-            changes = keys1.symmetric_difference(keys2)
-
-            for file_change in changes:
-                change_node = node1.children[file_change] if file_change in keys1 else node2.children[file_change]
-                if not current_path:
-                    final_path = f"{'/'.join(current_path)}/{file_change}"
-                else:
-                    final_path = f"/{'/'.join(current_path)}/{file_change}"
-                if file_change in keys1:
-                    changes_dic["Additions"].append((final_path, change_node.id, change_node.isDir))
-                else:
-                    changes_dic["Deletions"].append((final_path, change_node.id, change_node.isDir))
-
-            for key in common_keys:
-                size_from_node_1 = node1.children[key].fileSize
-                size_from_node_2 = node2.children[key].fileSize
-
-                file_id_in_gdrive = node1.children[key].id
-                if not current_path:
-                    final_path = f"{'/'.join(current_path)}/{key}"
-                else:
-                    final_path = f"/{'/'.join(current_path)}/{key}"
-
-                if not file_id_in_gdrive:
-                    file_id_in_gdrive = node2.children[key].id
-
-                if not os.path.isdir(key) and int(size_from_node_1) != int(size_from_node_2):
-                    changes_dic["Modifications"].append((final_path, file_id_in_gdrive, False))
-
-                compare_and_print_paths(node1.children[key], node2.children[key], current_path + [key])
-
-        if self.root and tree2.root:
-            compare_and_print_paths(self.root, tree2.root, [])
+    def iter_differences(self, tree2, hash_func=None, self_is_local=True):
+        """
+        Compare two trees and yield the differences as soon as they are found.
 
-        return changes_dic
+        Nodes only present in this tree are additions, nodes only present in tree2 are deletions,
+        the content of added or deleted folders is not reported separately. A file replaced by
+        a folder or back is a deletion of the old node followed by an addition of the new one.
+        Files are modified when their sizes differ. Files of the same size are also compared
+        by MD5 checksum, computed with hash_func for the local file when it is not known yet.
+        A Google Drive file without a checksum is modified, as nothing proves it is the same.
+
+        The trees are walked iteratively, so the depth is not limited by the recursion limit,
+        and the path of every folder is built once and shared by its children.
+        The trees must not be modified until the generator is exhausted.
+
+        Parameters:
+        - tree2: The second tree to compare with.
+        - hash_func: Callable returning the MD5 checksum of a local file by its path, enables checksum comparison.
+        - self_is_local: Boolean indicating whether this tree is the local one, the other is Google Drive.
+
+        Yields:
+        Difference records.
+        """
+        if not self.root or not tree2.root:
+            return
+        stack = [(self.root, tree2.root, '')]
+        while stack:
+            node1, node2, prefix = stack.pop()
+            children1, children2 = node1.children, node2.children
+
+            for key, child in children1.items():
+                if key not in children2:
+                    yield Difference("Additions", f"{prefix}/{key}", child.id, child.isDir)
+            for key, child in children2.items():
+                if key not in children1:
+                    yield Difference("Deletions", f"{prefix}/{key}", child.id, child.isDir)
+
+            for key, child1 in children1.items():
+                child2 = children2.get(key)
+                if child2 is None:
+                    continue
+                path = f"{prefix}/{key}"
+                if bool(child1.isDir) != bool(child2.isDir):
+                    # A file replaced by a folder or back, the old node goes before the new one is added
+                    yield Difference("Deletions", path, child2.id, child2.isDir)
+                    yield Difference("Additions", path, child1.id, child1.isDir)
+                    continue
+                local, remote = (child1, child2) if self_is_local else (child2, child1)
+                if (not child1.isDir and not child2.isDir
+                        and self._is_modified(local, remote, path, hash_func)):
+                    yield Difference("Modifications", path, child1.id or child2.id, False)
+                if child1.children or child2.children:
+                    stack.append((child1, child2, path))
+
+    @staticmethod
+    def _is_modified(local, remote, path, hash_func=None):
+        """
+        Check whether a local file and a Google Drive file located at the same path have different content.
+
+        hash_func reads the local file, so only the local node gets a computed checksum.
+        """
+        if int(local.fileSize or 0) != int(remote.fileSize or 0):
+            return True
+        if hash_func is None:
+            return False
+        if remote.md5 is None:
+            # Unknown checksum, e.g. Google Docs, the content can't be compared
+            return True
+        # The computed checksum is kept in the node to be reused by the reverse comparison
+        if local.md5 is None:
+            local.md5 = hash_func(path)
+        return local.md5 != remote.md5
 
     def traverse_and_print(self, node=None):
         """
@@ -208,26 +300,36 @@ class Tree:
             return node, nodes_traversed  # Return the current node and nodes traversed
 
     def find_parent_node_by_id(self, file_id):
-        if self.root:
-            return self._find_parent_node_by_id(self.root, file_id)
+        """
+        Get the parent of the node with the given drive ID.
 
-    def _find_parent_node_by_id(self, node, file_id):
+        Parameters:
+        - file_id: Drive ID of the child node.
 
-        for child in node.children:
-            if node.children[child].id == file_id:
-                return node
-            result = self._find_parent_node_by_id(node.children[child], file_id)
-            if result:
-                return result
-        return None
+        Returns:
+        The parent node or None if the ID is not in the tree or belongs to the root.
+        """
+        node = self.nodes_by_id.get(file_id)
+        return node.parent if node else None
 
     def find_child_nodes_by_id(self, file_id, node=None):
-        node = node if node else self.root
-        return self._find_child_nodes_by_id(file_id, node)
-
-    def _find_child_nodes_by_id(self, file_id, node):
-        if node.id == file_id:
-            return node.children
-        if node.children:
-            for child in node.children.values():
-                return self._find_child_nodes_by_id(file_id, child)
+        """
+        Get the children of the node with the given drive ID.
+
+        Parameters:
+        - file_id: Drive ID of the parent node.
+        - node: Only look for the ID below this node, the whole tree by default.
+
+        Returns:
+        A dictionary of child nodes keyed by their names or None if the ID is not found.
+        """
+        found = self.nodes_by_id.get(file_id)
+        if found is None:
+            return None
+        if node is not None and node is not self.root:
+            ancestor = found
+            while ancestor is not None and ancestor is not node:
+                ancestor = ancestor.parent
+            if ancestor is None:
+                return None
+        return found.children